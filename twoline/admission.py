@@ -0,0 +1,277 @@
+from collections import defaultdict
+import heapq
+import itertools
+import time
+
+from twoline.clock import timestamp
+from twoline.exceptions import QuotaExceeded
+
+
+REJECT = 'reject'
+OLDEST = 'oldest'
+EXPIRING = 'expiring'
+PRIORITY = 'priority'
+POLICIES = (REJECT, OLDEST, EXPIRING, PRIORITY)
+
+# Heaps are rebuilt from the live entries once stale ones outnumber them
+# by this factor (plus a little slack, so small stores are left alone).
+COMPACT_FACTOR = 2
+COMPACT_SLACK = 64
+
+
+def get_text_size(message):
+    text = message.message or u''
+    if isinstance(text, bytes):
+        return len(text)
+    return len(text.encode('utf-8'))
+
+
+# Bounds the message store by count, by total text size and by the number
+# of messages each producer may keep.  When storing a message would exceed
+# a limit, either the write is refused or enough messages are chosen for
+# eviction according to ``policy``.
+#
+# Candidates for eviction are kept in heaps ordered by the policy, one for
+# the whole store and one per producer.  Entries are not removed from the
+# heaps when their message goes away; they are recognised as stale (their
+# message is gone, or has since been replaced) and skipped when they reach
+# the top.
+class AdmissionControl(object):
+    def __init__(
+        self, max_messages=None, max_bytes=None, max_per_producer=None,
+        policy=REJECT
+    ):
+        if policy not in POLICIES:
+            raise ValueError(
+                'Eviction policy must be one of %s' % ', '.join(POLICIES)
+            )
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_per_producer = max_per_producer
+        self.policy = policy
+
+        self.sequence = itertools.count()
+        # Message id -> (sequence, producer, text size)
+        self.entries = {}
+        self.total_bytes = 0
+        self.producer_counts = defaultdict(int)
+        self.heap = []
+        self.producer_heaps = defaultdict(list)
+
+    def is_enabled(self):
+        return (
+            self.max_messages is not None
+            or self.max_bytes is not None
+            or self.max_per_producer is not None
+        )
+
+    def get_key(self, message, sequence):
+        if self.policy == EXPIRING:
+            # Messages that never expire go last, oldest first.
+            if message.expires is None:
+                return (1, 0, sequence)
+            return (0, timestamp(message.expires), sequence)
+        if self.policy == PRIORITY:
+            return (message.priority or 0, sequence)
+        return (sequence, )
+
+    def is_live(self, entry):
+        id_ = entry[-1]
+        sequence = entry[-2]
+        current = self.entries.get(id_)
+        return current is not None and current[0] == sequence
+
+    def add(self, message, producer=None):
+        self.remove(message.id)
+        if not self.is_enabled():
+            return
+        sequence = next(self.sequence)
+        size = get_text_size(message)
+        self.entries[message.id] = (sequence, producer, size)
+        self.total_bytes += size
+        self.producer_counts[producer] += 1
+        if self.policy != REJECT:
+            entry = self.get_key(message, sequence) + (sequence, message.id)
+            heapq.heappush(self.heap, entry)
+            heapq.heappush(self.producer_heaps[producer], entry)
+
+    def remove(self, id_):
+        entry = self.entries.pop(id_, None)
+        if entry is None:
+            return
+        sequence, producer, size = entry
+        self.total_bytes -= size
+        self.producer_counts[producer] -= 1
+        if not self.producer_counts[producer]:
+            del self.producer_counts[producer]
+            self.producer_heaps.pop(producer, None)
+        if len(self.heap) > (
+            COMPACT_FACTOR * len(self.entries) + COMPACT_SLACK
+        ):
+            self.compact()
+
+    def compact(self):
+        self.heap = [entry for entry in self.heap if self.is_live(entry)]
+        heapq.heapify(self.heap)
+        for producer, heap in list(self.producer_heaps.items()):
+            heap = [entry for entry in heap if self.is_live(entry)]
+            heapq.heapify(heap)
+            self.producer_heaps[producer] = heap
+
+    def pop_victim(self, heap, exempt):
+        # Pops and returns the entry of the next message to evict, leaving
+        # out those in ``exempt`` (about to be written, or already chosen).
+        skipped = []
+        victim = None
+        while heap:
+            entry = heapq.heappop(heap)
+            if not self.is_live(entry):
+                continue
+            if entry[-1] in exempt:
+                skipped.append(entry)
+                continue
+            victim = entry
+            break
+        for entry in skipped:
+            heapq.heappush(heap, entry)
+        return victim
+
+    def admit(self, message, producer=None):
+        return self.admit_all([message], producer)
+
+    def admit_all(self, messages, producer=None):
+        # Returns the ids of the messages to delete before all of
+        # ``messages`` can be stored, or raises ``QuotaExceeded`` if they
+        # cannot be.  Nothing changes until the caller deletes and stores
+        # them; the heaps are left as they were either way.
+        if not self.is_enabled():
+            return []
+        exempt = set(message.id for message in messages)
+        count = len(self.entries)
+        total_bytes = self.total_bytes
+        producer_count = self.producer_counts.get(producer, 0)
+        # Message id -> (producer, text size) once the batch is stored
+        written = {}
+        evicted = []
+        taken = []
+
+        def over_producer_quota():
+            return (
+                self.max_per_producer is not None
+                and producer_count > self.max_per_producer
+            )
+
+        def over_store_limits():
+            return (
+                self.max_messages is not None and count > self.max_messages
+            ) or (
+                self.max_bytes is not None and total_bytes > self.max_bytes
+            )
+
+        def get_heap():
+            if over_producer_quota():
+                return self.producer_heaps.get(producer, [])
+            return self.heap
+
+        try:
+            for message in messages:
+                size = get_text_size(message)
+                if self.max_bytes is not None and size > self.max_bytes:
+                    raise QuotaExceeded(
+                        'Message text exceeds the limit of %s bytes'
+                        % self.max_bytes
+                    )
+                existing = written.get(message.id)
+                if existing is None and message.id in self.entries:
+                    existing = self.entries[message.id][1:]
+                if existing is None:
+                    count += 1
+                else:
+                    total_bytes -= existing[1]
+                    if existing[0] == producer:
+                        producer_count -= 1
+                total_bytes += size
+                producer_count += 1
+                written[message.id] = producer, size
+
+                if self.policy == REJECT:
+                    if over_producer_quota():
+                        raise QuotaExceeded(
+                            'Producer %s may store at most %s messages' % (
+                                producer, self.max_per_producer
+                            )
+                        )
+                    if over_store_limits():
+                        raise QuotaExceeded('Message store is full')
+                    continue
+
+                if self.policy == PRIORITY and (
+                    over_producer_quota() or over_store_limits()
+                ):
+                    # Nothing is evicted in favour of a less important
+                    # message.
+                    heap = get_heap()
+                    lowest = self.pop_victim(heap, exempt)
+                    if lowest is not None:
+                        heapq.heappush(heap, lowest)
+                        if lowest[0] > (message.priority or 0):
+                            raise QuotaExceeded(
+                                'Message store is full of higher priority '
+                                'messages'
+                            )
+
+                while over_producer_quota() or over_store_limits():
+                    heap = get_heap()
+                    victim = self.pop_victim(heap, exempt)
+                    if victim is None:
+                        raise QuotaExceeded('Message store is full')
+                    taken.append((heap, victim))
+                    id_ = victim[-1]
+                    exempt.add(id_)
+                    _, victim_producer, victim_size = self.entries[id_]
+                    count -= 1
+                    total_bytes -= victim_size
+                    if victim_producer == producer:
+                        producer_count -= 1
+                    evicted.append(id_)
+        finally:
+            # Entries of evicted messages go stale once they are removed.
+            for heap, entry in taken:
+                heapq.heappush(heap, entry)
+        return evicted
+
+
+# Token bucket per source: each may make ``burst`` requests at once and
+# ``rate`` more per minute after that.
+class RateLimiter(object):
+    MAX_SOURCES = 1024
+
+    def __init__(self, rate, burst=None, clock=time, name='requests'):
+        self.rate = rate / 60.0
+        self.burst = burst or max(1, int(rate))
+        self.clock = clock
+        self.name = name
+        # Source -> (tokens, when they were counted)
+        self.buckets = {}
+
+    def get_tokens(self, source, now):
+        tokens, counted_at = self.buckets.get(source, (self.burst, now))
+        return min(self.burst, tokens + (now - counted_at) * self.rate)
+
+    def check(self, source):
+        # Takes a token for ``source``, or raises ``QuotaExceeded``.
+        now = self.clock.time()
+        tokens = self.get_tokens(source, now)
+        if tokens < 1:
+            raise QuotaExceeded(
+                '%s may send at most %s %s per minute' % (
+                    source, int(self.rate * 60), self.name
+                )
+            )
+        self.buckets[source] = (tokens - 1, now)
+        if len(self.buckets) > self.MAX_SOURCES:
+            # Sources whose buckets have filled up again are as good as
+            # new; forget them.
+            for other in list(self.buckets):
+                if self.get_tokens(other, now) >= self.burst:
+                    del self.buckets[other]
@@ -0,0 +1,331 @@
+import datetime
+import json
+import logging
+from optparse import OptionParser
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+import pytz
+from six.moves import cPickle as pickle
+
+from twoline import ipc
+from twoline.clock import SimulatedClock
+
+
+BENCHMARKS = {}
+# Benchmarks run only when named: they start a real instance, so their
+# results depend on the host far more than the others' do.
+EXPLICIT_BENCHMARKS = ('listener', )
+
+VIRTUAL_DEVICE = '/dev/null'
+# Numbers of messages in rotation for the manager benchmarks, and message
+# lengths for the LCD ones.
+MESSAGE_COUNTS = (10, 100, 1000, 10000, 100000)
+MESSAGE_LENGTHS = (16, 64, 256, 1024)
+EXPIRING_FRACTION = 10
+
+
+def benchmark(fn):
+    BENCHMARKS[fn.__name__.replace('bench_', '')] = fn
+    return fn
+
+
+def time_per_call(fn, number):
+    # Best of three runs, in microseconds per call.
+    return min(timeit.repeat(fn, number=number, repeat=3)) / number * 1e6
+
+
+def get_ipc_frames():
+    message = {
+        'id': '0123456789abcdef0123456789abcdef',
+        'message': u'Deploy of web-frontend finished on 12 hosts',
+        'color': [0, 255, 0],
+        'backlight': True,
+        'interval': 5,
+        'tags': [u'deploy'],
+        'expires': datetime.datetime(
+            2030, 1, 1, 12, 0, tzinfo=pytz.UTC
+        ),
+    }
+    flash = {
+        'message': u'Build failed!',
+        'blink': [(255, 0, 0), (0, 0, 0)],
+        'backlight': True,
+        'timeout': 10,
+    }
+    return [
+        ('display message', ('message', [message])),
+        ('display flash', ('message', [flash])),
+        ('set brightness', ('set_brightness', [128])),
+        ('post message', (
+            'post_message', ['{"message": "Hello World", "interval": 10}']
+        )),
+        ('patch message', (
+            'patch_message_by_id', [message['id'], '{"color": [1, 2, 3]}']
+        )),
+        ('response', ('response', [message])),
+    ]
+
+
+@benchmark
+def bench_ipc(number):
+    results = []
+    for name, frame in get_ipc_frames():
+        pickled = pickle.dumps(frame, pickle.HIGHEST_PROTOCOL)
+        encoded = ipc.encode(frame)
+        results.append({
+            'name': name,
+            'pickle_bytes': len(pickled),
+            'pickle_encode_us': time_per_call(
+                lambda: pickle.dumps(frame, pickle.HIGHEST_PROTOCOL), number
+            ),
+            'pickle_decode_us': time_per_call(
+                lambda: pickle.loads(pickled), number
+            ),
+            'ipc_bytes': len(encoded),
+            'ipc_encode_us': time_per_call(
+                lambda: ipc.encode(frame), number
+            ),
+            'ipc_decode_us': time_per_call(
+                lambda: ipc.decode(encoded), number
+            ),
+        })
+    return results
+
+
+def calls_for(number, size):
+    # Calls whose cost grows with ``size`` are timed fewer times.
+    return max(3, min(number, number * 10 // size))
+
+
+def get_manager(count):
+    from twoline.manager import Manager
+    from twoline.message import Message
+
+    clock = SimulatedClock()
+    manager = Manager(VIRTUAL_DEVICE, clock=clock)
+    # Some messages expire, though not while being measured, so that the
+    # expiry checks have something to compare.
+    expires = clock.utcnow() + datetime.timedelta(days=365)
+    for idx in range(count):
+        data = {'id': '%032x' % idx, 'message': u'Message %s' % idx}
+        if idx % EXPIRING_FRACTION == 0:
+            data['expires'] = expires
+        manager.store_message(
+            Message.from_dict(data, manager.default_message)
+        )
+    manager.get_current_message()
+    # Finding the current message's place costs more the further along
+    # the rotation it is; start halfway, as it is on average.
+    manager.message_id = manager.messages[count // 2].id
+    return manager
+
+
+@benchmark
+def bench_manager(number):
+    results = []
+    for count in MESSAGE_COUNTS:
+        manager = get_manager(count)
+        calls = calls_for(number, count)
+        timings = [
+            ('get_current_message', manager.get_current_message),
+            ('handle_expirations', manager.handle_expirations),
+            ('increment_index', manager.increment_index),
+            ('process_message', lambda: manager.process_message(
+                {'message': u'Hello World', 'expires': 3600}
+            )),
+        ]
+        for name, fn in timings:
+            results.append({
+                'name': '%s (%s)' % (name, count),
+                'messages': count,
+                'calls': calls,
+                'us_per_call': time_per_call(fn, calls),
+            })
+    return results
+
+
+@benchmark
+def bench_lcd(number):
+    from twoline.lcd import LcdManager
+
+    lcd = LcdManager(VIRTUAL_DEVICE, clock=SimulatedClock())
+    results = []
+    for length in MESSAGE_LENGTHS:
+        text = (u'The quick brown fox jumps over the lazy dog. ' * (
+            length // 45 + 1
+        ))[:length]
+        lcd.message = text
+        lcd.message_lines = lcd.get_message_lines(text)
+        lcd.text_idx = 0
+        for name, fn in (
+            ('get_message_lines', lambda: lcd.get_message_lines(text)),
+            ('handle_text_cycle', lcd.handle_text_cycle),
+        ):
+            results.append({
+                'name': '%s (%s chars)' % (name, length),
+                'length': length,
+                'calls': number,
+                'us_per_call': time_per_call(fn, number),
+            })
+    return results
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def bench_client(client, requests):
+    body = {'message': u'Benchmark'}
+    client.put_message('bench', body)
+    latencies = []
+    started = time.time()
+    for _ in range(requests):
+        sent = time.time()
+        client.get_message('bench')
+        latencies.append(time.time() - sent)
+    get_elapsed = time.time() - started
+    started = time.time()
+    for _ in range(requests):
+        client.put_message('bench', body)
+    put_elapsed = time.time() - started
+    return {
+        'get_p50_us': percentile(latencies, 0.5) * 1e6,
+        'get_p99_us': percentile(latencies, 0.99) * 1e6,
+        'get_per_second': requests / get_elapsed,
+        'put_per_second': requests / put_elapsed,
+    }
+
+
+@benchmark
+def bench_listener(number):
+    # Each request is a full HTTP round trip through a local instance, so
+    # far fewer are made than calls in the other benchmarks.
+    from twoline.client import Client
+    from twoline.replay import get_free_port, start_instance
+
+    requests = max(100, number // 10)
+    # The instance inherits this; logging each request would dominate.
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'twoline.sock')
+    port = get_free_port()
+    process = start_instance(port, {'unix_socket': path})
+    try:
+        results = []
+        for name, target in (
+            ('loopback tcp', '127.0.0.1:%s' % port),
+            ('unix socket', 'unix:%s' % path),
+        ):
+            client = Client(target)
+            result = bench_client(client, requests)
+            client.close()
+            result['name'] = name
+            results.append(result)
+        return results
+    finally:
+        process.terminate()
+        process.join()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def print_results(results):
+    columns = sorted(set(
+        key for result in results for key in result if key != 'name'
+    ))
+    width = max(len(result['name']) for result in results)
+    print(' '.join(
+        ['name'.ljust(width)] + [column.rjust(16) for column in columns]
+    ))
+    for result in results:
+        print(' '.join(
+            [result['name'].ljust(width)] + [
+                (
+                    '%.2f' % result[column]
+                    if isinstance(result[column], float)
+                    else str(result[column])
+                ).rjust(16)
+                for column in columns
+            ]
+        ))
+
+
+def get_git_revision():
+    # The revision of the checkout the benchmarks run from, if any.
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        with open(os.devnull, 'w') as devnull:
+            revision = subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], cwd=directory, stderr=devnull
+            ).strip().decode('ascii')
+            dirty = subprocess.call(
+                ['git', 'diff', '--quiet', 'HEAD'],
+                cwd=directory, stdout=devnull, stderr=devnull
+            )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return revision + ('-dirty' if dirty else '')
+
+
+def get_metadata(number):
+    # Identifies a run so that results kept with ``--json`` can be
+    # compared over time.
+    return {
+        'time': datetime.datetime.utcnow().replace(
+            tzinfo=pytz.UTC
+        ).isoformat(),
+        'host': socket.gethostname(),
+        'platform': platform.platform(),
+        'python': '%s %s' % (
+            platform.python_implementation(), platform.python_version()
+        ),
+        'git_revision': get_git_revision(),
+        'number': number,
+    }
+
+
+def main(args=None):
+    parser = OptionParser(
+        usage='%%prog [options] [%s]' % '|'.join(sorted(BENCHMARKS))
+    )
+    parser.add_option(
+        '--number', '-n', dest='number', default='10000',
+        help='Number of calls per timing run',
+    )
+    parser.add_option(
+        '--json', dest='json', default=None,
+        help='Also write results as JSON to this path',
+    )
+    options, args = parser.parse_args(args)
+
+    names = args or sorted(set(BENCHMARKS) - set(EXPLICIT_BENCHMARKS))
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error('Unknown benchmark \'%s\'' % name)
+
+    metadata = get_metadata(int(options.number))
+    all_results = {}
+    for name in names:
+        print('== %s ==' % name)
+        results = BENCHMARKS[name](int(options.number))
+        print_results(results)
+        all_results[name] = results
+
+    if options.json:
+        with open(options.json, 'w') as out:
+            json.dump(
+                {'metadata': metadata, 'results': all_results},
+                out, indent=2, sort_keys=True
+            )
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,61 @@
+import json
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# Wraps a request stream that the view reads itself, keeping a copy of
+# what it read; ``request.data`` is empty once the stream has been read.
+class TeeStream(object):
+    def __init__(self, stream):
+        self.stream = stream
+        self.chunks = []
+
+    def read(self, *args):
+        chunk = self.stream.read(*args)
+        self.chunks.append(chunk)
+        return chunk
+
+    def getvalue(self):
+        return b''.join(self.chunks)
+
+
+# Appends one JSON object per handled API request to a file so that the
+# traffic can later be played back with ``twoline replay``.
+class TrafficCapture(object):
+    def __init__(self, path):
+        self.path = path
+        self.out = open(path, 'a')
+        logger.info('Capturing API requests to %s', path)
+
+    def record(self, request, response, started, finished, body=None):
+        if body is None:
+            body = request.data
+        # Responses are not streamed while capturing (see
+        # ``json_response``); any that still are go unrecorded.
+        response_body = None
+        if not response.is_streamed:
+            response_body = response.data.decode('utf-8', 'replace')
+        self.out.write(json.dumps({
+            'time': started,
+            'duration': finished - started,
+            'method': request.method,
+            'path': request.path,
+            'query': request.query_string,
+            'content_type': request.headers.get('Content-Type'),
+            'body': body.decode('utf-8', 'replace'),
+            'status': response.status_code,
+            'response': response_body,
+        }) + '\n')
+        self.out.flush()
+
+    def close(self):
+        self.out.close()
+
+
+def read_capture(path):
+    with open(path, 'r') as in_:
+        for line in in_:
+            if line.strip():
+                yield json.loads(line)
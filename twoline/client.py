@@ -0,0 +1,377 @@
+from functools import partial
+import json
+import logging
+import random
+import socket
+import tempfile
+import threading
+import time
+
+import six
+from six.moves import http_client
+
+from twoline.exceptions import ClientError
+
+try:
+    import asyncio
+except ImportError:
+    # Only available from Python 3.4.
+    asyncio = None
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_PORT = 6224
+DEFAULT_TIMEOUT = 5
+DEFAULT_POOL_SIZE = 4
+DEFAULT_RETRIES = 2
+DEFAULT_RETRY_DELAY = 0.1
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_BATCH_DELAY = 0.1
+# Uploads are spooled to find their length; larger ones go to disk.
+UPLOAD_SPOOL_SIZE = 1024 * 1024
+
+# Requests that may be sent again when it is unclear whether the first
+# attempt reached the instance; the others are only retried when they
+# could not have been sent at all.
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE')
+
+
+def parse_target(target):
+    # Returns ``(host, port)``, or ``(path, None)`` for a Unix socket
+    # given as ``unix:PATH`` or an absolute path.
+    if target.startswith('unix:'):
+        return target[len('unix:'):], None
+    if target.startswith('/'):
+        return target, None
+    if '://' in target:
+        target = target.split('://', 1)[1]
+    target = target.rstrip('/')
+    if ':' in target:
+        host, port = target.rsplit(':', 1)
+        return host, int(port)
+    return target, DEFAULT_PORT
+
+
+class UnixHTTPConnection(http_client.HTTPConnection):
+    def __init__(self, path, timeout):
+        http_client.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except socket.error:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+# Idle connections to one instance, shared by the threads using a client.
+class ConnectionPool(object):
+    def __init__(self, connect, size=DEFAULT_POOL_SIZE):
+        self.connect = connect
+        self.size = size
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def get(self):
+        # Returns a connection and whether it has been used before.
+        with self.lock:
+            if self.idle:
+                return self.idle.pop(), True
+        return self.connect(), False
+
+    def put(self, connection):
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+
+
+def parse_response(response, body):
+    try:
+        return response.status, json.loads(body.decode('utf-8'))
+    except ValueError:
+        return response.status, body
+
+
+# Persistent HTTP/1.1 connections to one twoline instance.  Servers that
+# close the connection after a response (as the built-in one does) are
+# reconnected to transparently on the next request, and failed requests
+# are retried after a randomized, growing delay.
+class Client(object):
+    def __init__(
+        self, target, timeout=DEFAULT_TIMEOUT, pool_size=DEFAULT_POOL_SIZE,
+        retries=DEFAULT_RETRIES, retry_delay=DEFAULT_RETRY_DELAY
+    ):
+        self.host, self.port = parse_target(target)
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.pool = ConnectionPool(self.connect, pool_size)
+
+    def __str__(self):
+        if self.port is None:
+            return 'unix:%s' % self.host
+        return '%s:%s' % (self.host, self.port)
+
+    def connect(self):
+        if self.port is None:
+            return UnixHTTPConnection(self.host, self.timeout)
+        return http_client.HTTPConnection(
+            self.host, self.port, timeout=self.timeout
+        )
+
+    def close(self):
+        self.pool.close()
+
+    def send(self, method, path, data, headers):
+        # Returns the response, or raises the error and whether the
+        # request may have been sent.
+        while True:
+            connection, reused = self.pool.get()
+            if not reused:
+                try:
+                    connection.connect()
+                except socket.error as e:
+                    connection.close()
+                    raise ClientError(str(e), False)
+            try:
+                connection.request(method, path, data, headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (socket.error, http_client.HTTPException) as e:
+                connection.close()
+                # A kept-alive connection may have been closed by the
+                # server in the meantime; that alone is worth one retry.
+                if reused:
+                    continue
+                raise ClientError(str(e), True)
+            if response.will_close:
+                connection.close()
+            else:
+                self.pool.put(connection)
+            return parse_response(response, body)
+
+    def request(self, method, path, data=None):
+        if data is not None and not isinstance(data, six.string_types):
+            data = json.dumps(data)
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+
+        attempt = 0
+        while True:
+            try:
+                return self.send(method, path, data, headers)
+            except ClientError as e:
+                error, sent = e.args
+            if attempt >= self.retries or (
+                sent and method not in IDEMPOTENT_METHODS
+            ):
+                raise ClientError('%s %s on %s failed: %s' % (
+                    method, path, self, error
+                ))
+            # Full jitter keeps many producers retrying against the same
+            # instance from doing so in lockstep.
+            time.sleep(random.uniform(0, self.retry_delay * 2 ** attempt))
+            attempt += 1
+
+    def upload(self, path, chunks, content_type='application/x-ndjson'):
+        # POSTs the byte strings in ``chunks`` on a connection of its own.
+        # They are spooled first so that the request can give its
+        # Content-Length; the built-in server does not understand chunked
+        # transfer encoding and would see an empty body.
+        spool = tempfile.SpooledTemporaryFile(UPLOAD_SPOOL_SIZE)
+        connection = self.connect()
+        try:
+            for chunk in chunks:
+                spool.write(chunk)
+            length = spool.tell()
+            spool.seek(0)
+            connection.request('POST', path, spool, {
+                'Content-Type': content_type,
+                'Content-Length': str(length),
+            })
+            response = connection.getresponse()
+            body = response.read()
+        except (socket.error, http_client.HTTPException) as e:
+            raise ClientError('POST %s on %s failed: %s' % (path, self, e))
+        finally:
+            connection.close()
+            spool.close()
+        return parse_response(response, body)
+
+    def load_messages(self, chunks):
+        return self.upload('/bulk/', chunks)
+
+    def post_messages(self, messages):
+        # Stores many messages in one request; messages with an ``id``
+        # replace that message.
+        messages = [
+            {'message': message}
+            if isinstance(message, six.string_types) else message
+            for message in messages
+        ]
+        return self.load_messages([b''.join(
+            json.dumps(message).encode('utf-8') + b'\n'
+            for message in messages
+        )])
+
+    def batch(self, size=DEFAULT_BATCH_SIZE, delay=DEFAULT_BATCH_DELAY,
+              callback=None):
+        return Batch(self, size, delay, callback)
+
+    def get_messages(self):
+        return self.request('GET', '/message/')
+
+    def post_message(self, message):
+        return self.request('POST', '/message/', message)
+
+    def get_message(self, message_id):
+        return self.request('GET', '/message/%s/' % message_id)
+
+    def put_message(self, message_id, message):
+        return self.request('PUT', '/message/%s/' % message_id, message)
+
+    def patch_message(self, message_id, message):
+        return self.request('PATCH', '/message/%s/' % message_id, message)
+
+    def delete_message(self, message_id):
+        return self.request('DELETE', '/message/%s/' % message_id)
+
+    def get_flash(self):
+        return self.request('GET', '/flash/')
+
+    def put_flash(self, message):
+        return self.request('PUT', '/flash/', message)
+
+    def delete_flash(self):
+        return self.request('DELETE', '/flash/')
+
+
+# Collects messages to store and sends them to the instance together,
+# once ``size`` are waiting or ``delay`` seconds after the first of them
+# was added (whichever comes first).  ``callback``, if given, receives
+# the result of each load; delayed loads are made from a timer thread.
+class Batch(object):
+    def __init__(
+        self, client, size=DEFAULT_BATCH_SIZE, delay=DEFAULT_BATCH_DELAY,
+        callback=None
+    ):
+        self.client = client
+        self.size = size
+        self.delay = delay
+        self.callback = callback
+        self.queued = []
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def add(self, message):
+        with self.lock:
+            self.queued.append(message)
+            full = len(self.queued) >= self.size
+            if not full and self.timer is None and self.delay is not None:
+                self.timer = threading.Timer(self.delay, self.flush_later)
+                self.timer.daemon = True
+                self.timer.start()
+        if full:
+            return self.flush()
+
+    def flush_later(self):
+        try:
+            self.flush()
+        except ClientError as e:
+            logger.error('Failed to store batched messages: %s', e)
+
+    def flush(self):
+        with self.lock:
+            queued, self.queued = self.queued, []
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        if not queued:
+            return None
+        status, result = self.client.post_messages(queued)
+        if status != 200:
+            raise ClientError('Loading %s messages on %s failed: HTTP %s' % (
+                len(queued), self.client, status
+            ))
+        for error in result['errors']:
+            error['message'] = queued[error['line'] - 1]
+        if self.callback is not None:
+            self.callback(result)
+        return result
+
+
+# A thread-pool shim giving a ``Client`` an asyncio interface, not a
+# native asyncio client: each method runs the corresponding blocking
+# ``Client`` method in ``executor`` (the event loop's default one unless
+# given) and returns a future for its result.  How many requests are in
+# flight at once is bounded by the executor's threads.
+class AsyncClient(object):
+    def __init__(self, target, loop=None, executor=None, **kwargs):
+        if asyncio is None:
+            raise RuntimeError('AsyncClient requires Python 3.4 or newer')
+        self.client = Client(target, **kwargs)
+        self.loop = loop or asyncio.get_event_loop()
+        self.executor = executor
+
+    def __str__(self):
+        return str(self.client)
+
+    def run(self, fn, *args):
+        return self.loop.run_in_executor(self.executor, partial(fn, *args))
+
+    def close(self):
+        self.client.close()
+
+    def request(self, method, path, data=None):
+        return self.run(self.client.request, method, path, data)
+
+    def post_messages(self, messages):
+        return self.run(self.client.post_messages, messages)
+
+    def get_messages(self):
+        return self.run(self.client.get_messages)
+
+    def post_message(self, message):
+        return self.run(self.client.post_message, message)
+
+    def get_message(self, message_id):
+        return self.run(self.client.get_message, message_id)
+
+    def put_message(self, message_id, message):
+        return self.run(self.client.put_message, message_id, message)
+
+    def patch_message(self, message_id, message):
+        return self.run(self.client.patch_message, message_id, message)
+
+    def delete_message(self, message_id):
+        return self.run(self.client.delete_message, message_id)
+
+    def get_flash(self):
+        return self.run(self.client.get_flash)
+
+    def put_flash(self, message):
+        return self.run(self.client.put_flash, message)
+
+    def delete_flash(self):
+        return self.run(self.client.delete_flash)
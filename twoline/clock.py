@@ -0,0 +1,44 @@
+import datetime
+import time
+
+import pytz
+
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=pytz.UTC)
+
+
+def timestamp(value):
+    return (value - EPOCH).total_seconds()
+
+
+# Where the manager and LCD worker get the current time from, and how
+# they wait; replaced by a ``SimulatedClock`` to run their scheduling
+# faster than real time.
+class Clock(object):
+    def time(self):
+        return time.time()
+
+    def utcnow(self):
+        return datetime.datetime.utcnow().replace(tzinfo=pytz.UTC)
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class SimulatedClock(Clock):
+    def __init__(self, start=None):
+        if start is None:
+            start = time.time()
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def utcnow(self):
+        return datetime.datetime.fromtimestamp(self.now, pytz.UTC)
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        self.now += seconds
@@ -1,11 +1,29 @@
+import importlib
 import json
 import logging.config
 from optparse import OptionParser
+import sys
 
-from twoline.manager import Manager
+from twoline import diagnostics, startup, tracing
+from twoline.admission import POLICIES, REJECT
+
+
+# Commands other than running the display itself, as ``twoline <name>``;
+# each module's ``main`` receives the remaining arguments.
+SUBCOMMANDS = {
+    'bench': 'twoline.bench',
+    'fleet': 'twoline.fleet',
+    'load': 'twoline.load',
+    'replay': 'twoline.replay',
+    'simulate': 'twoline.simulation',
+}
 
 
 def run_from_cmdline():
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        module = importlib.import_module(SUBCOMMANDS[sys.argv[1]])
+        return module.main(sys.argv[2:])
+
     parser = OptionParser()
     parser.add_option(
         '--port', '-p', dest='port', default='6224'
@@ -13,12 +31,47 @@ def run_from_cmdline():
     parser.add_option(
         '--ip', '-i', dest='ip', default='0.0.0.0'
     )
+    parser.add_option(
+        '--unix-socket', '-u', dest='unix_socket', default=None,
+        help='Also serve the API on a Unix domain socket at this path',
+    )
+    parser.add_option(
+        '--no-tcp', dest='tcp', action='store_false', default=True,
+        help='Serve the API only on the Unix domain socket',
+    )
     parser.add_option(
         '--loglevel', '-l', dest='loglevel', default='INFO'
     )
     parser.add_option(
         '--logcfg', dest='logcfg', default=None
     )
+    parser.add_option(
+        '--event-buffer-size',
+        dest='event_buffer_size',
+        default=str(diagnostics.DEFAULT_EVENT_BUFFER_SIZE),
+        help=(
+            'Number of recent log events each process keeps in memory '
+            'for /events/; 0 disables the buffer'
+        ),
+    )
+    parser.add_option(
+        '--event-level',
+        dest='event_level',
+        default=None,
+        help=(
+            'Lowest level recorded in the event buffer; defaults to '
+            '--loglevel'
+        ),
+    )
+    parser.add_option(
+        '--log-sample-interval',
+        dest='log_sample_interval',
+        default=str(diagnostics.DEFAULT_SAMPLE_INTERVAL),
+        help=(
+            'Minimum number of seconds between repeated debug messages '
+            'from the same place in the display loops'
+        ),
+    )
     parser.add_option(
         '--size-x', '-x', dest='size_x', default='16',
     )
@@ -31,6 +84,107 @@ def run_from_cmdline():
     parser.add_option(
         '--blink-interval', dest='blink_interval', default='0.25'
     )
+    parser.add_option(
+        '--single-process',
+        dest='single_process',
+        action='store_true',
+        default=False,
+        help=(
+            'Run the web server, manager and LCD driver in a single '
+            'process to reduce memory usage'
+        ),
+    )
+    parser.add_option(
+        '--provider-modules',
+        dest='provider_modules',
+        default=None,
+        help=(
+            'Comma-separated list of modules to import for additional '
+            'message content providers'
+        ),
+    )
+    parser.add_option(
+        '--startup-profile',
+        dest='startup_profile',
+        action='store_true',
+        default=False,
+        help=(
+            'Log time-to-first-frame and time-to-first-HTTP-accept for '
+            'each process'
+        ),
+    )
+    parser.add_option(
+        '--trace',
+        dest='trace',
+        default=None,
+        help=(
+            'Write a timeline of every API request through the web, '
+            'manager and LCD processes to this file (Chrome trace format)'
+        ),
+    )
+    parser.add_option(
+        '--capture',
+        dest='capture',
+        default=None,
+        help=(
+            'Append every API request and its response to this file for '
+            'later use with \'twoline replay\''
+        ),
+    )
+    parser.add_option(
+        '--max-messages',
+        dest='max_messages',
+        default=None,
+        help='Most messages to keep at once',
+    )
+    parser.add_option(
+        '--max-message-bytes',
+        dest='max_message_bytes',
+        default=None,
+        help='Most bytes of message text to keep at once',
+    )
+    parser.add_option(
+        '--max-messages-per-producer',
+        dest='max_messages_per_producer',
+        default=None,
+        help=(
+            'Most messages each producer (named by the X-Twoline-Producer '
+            'header, or else the client address) may keep at once'
+        ),
+    )
+    parser.add_option(
+        '--eviction-policy',
+        dest='eviction_policy',
+        type='choice',
+        choices=list(POLICIES),
+        default=REJECT,
+        help=(
+            'What to do with a message that would exceed a limit: reject '
+            'it (HTTP 429), or evict the oldest, soonest-expiring or '
+            'lowest priority messages to make room'
+        ),
+    )
+    parser.add_option(
+        '--flash-interval',
+        dest='flash_interval',
+        default='1',
+        help=(
+            'Seconds a flash message is shown for, at least, before '
+            'another waiting to be shown replaces it'
+        ),
+    )
+    parser.add_option(
+        '--flash-rate',
+        dest='flash_rate',
+        default=None,
+        help='Most flash messages each producer may send per minute',
+    )
+    parser.add_option(
+        '--flash-queue-size',
+        dest='flash_queue_size',
+        default='10',
+        help='Most flash messages waiting to be shown at once',
+    )
     parser.add_option(
         '--default-message-template',
         dest='default_message_template',
@@ -48,6 +202,8 @@ def run_from_cmdline():
 
     if len(args) != 1:
         parser.error('Device required (usually a path in /dev/)')
+    if not options.tcp and not options.unix_socket:
+        parser.error('--no-tcp requires --unix-socket')
 
     if options.logcfg:
         with open(options.logcfg, 'r') as in_:
@@ -61,5 +217,30 @@ def run_from_cmdline():
             datefmt='%H:%M:%S',
         )
 
+    diagnostics.set_sample_interval(float(options.log_sample_interval))
+    if int(options.event_buffer_size):
+        event_level = logging.getLevelName(
+            options.event_level or options.loglevel
+        )
+        root = logging.getLogger()
+        if event_level < root.level:
+            # Keep the console at its configured level while letting the
+            # more verbose records through to the event buffer.
+            for handler in root.handlers:
+                if handler.level < root.level:
+                    handler.setLevel(root.level)
+            root.setLevel(event_level)
+        diagnostics.install_event_buffer(
+            int(options.event_buffer_size), event_level
+        )
+
+    if options.startup_profile:
+        startup.enable()
+    if options.trace:
+        tracing.enable(options.trace)
+
+    from twoline.manager import Manager
+    startup.mark('manager', 'imports loaded')
+
     manager = Manager(*args, **vars(options))
     manager.run()
@@ -0,0 +1,105 @@
+from collections import deque
+import itertools
+import logging
+import time
+
+
+DEFAULT_EVENT_BUFFER_SIZE = 500
+DEFAULT_SAMPLE_INTERVAL = 5.0
+MAX_EVENT_MESSAGE_LENGTH = 500
+
+
+class EventBufferHandler(logging.Handler):
+    def __init__(self, size=DEFAULT_EVENT_BUFFER_SIZE, level=logging.NOTSET):
+        super(EventBufferHandler, self).__init__(level)
+        self.events = deque(maxlen=size)
+        self.sequence = itertools.count()
+
+    def emit(self, record):
+        try:
+            message = record.getMessage()
+            if len(message) > MAX_EVENT_MESSAGE_LENGTH:
+                message = message[:MAX_EVENT_MESSAGE_LENGTH] + '...'
+            self.events.append({
+                'seq': next(self.sequence),
+                'time': record.created,
+                'process': record.processName,
+                'pid': record.process,
+                'logger': record.name,
+                'level': record.levelname,
+                'message': message,
+            })
+        except Exception:
+            self.handleError(record)
+
+
+_handler = None
+_sample_interval = DEFAULT_SAMPLE_INTERVAL
+
+
+def install_event_buffer(
+    size=DEFAULT_EVENT_BUFFER_SIZE, level=logging.NOTSET
+):
+    global _handler
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+    _handler = EventBufferHandler(size, level)
+    logging.getLogger().addHandler(_handler)
+    return _handler
+
+
+def set_sample_interval(interval):
+    global _sample_interval
+    _sample_interval = interval
+
+
+def get_events(limit=None):
+    if _handler is None:
+        return []
+    events = list(_handler.events)
+    if limit is not None:
+        events = events[-limit:]
+    return events
+
+
+def merge_events(*sources):
+    # Processes forked from one another, or sharing a single process,
+    # report overlapping buffers; (pid, seq) identifies an event uniquely.
+    merged = {}
+    for events in sources:
+        for event in events or []:
+            merged[(event['pid'], event['seq'])] = event
+    return sorted(merged.values(), key=lambda event: event['time'])
+
+
+class SampledLog(object):
+    # Emits at most one record per ``interval`` seconds (by default, the
+    # interval set with ``set_sample_interval``) for a single call site,
+    # noting how many were suppressed in between.  Nothing is formatted
+    # unless the logger is enabled for ``level``.
+    def __init__(self, logger, level=logging.DEBUG, interval=None):
+        self.logger = logger
+        self.level = level
+        self.interval = interval
+        self.last_logged = None
+        self.suppressed = 0
+
+    def __call__(self, msg, *args):
+        if not self.logger.isEnabledFor(self.level):
+            return
+        interval = self.interval
+        if interval is None:
+            interval = _sample_interval
+        now = time.time()
+        if (
+            self.last_logged is not None
+            and now - self.last_logged < interval
+        ):
+            self.suppressed += 1
+            return
+        if self.suppressed:
+            msg += ' (%s similar messages suppressed)'
+            args += (self.suppressed, )
+        self.last_logged = now
+        self.suppressed = 0
+        self.logger.log(self.level, msg, *args)
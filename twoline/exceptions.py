@@ -16,3 +16,15 @@ class UnexpectedError(Exception):
 
 class LcdCommandError(Exception):
     pass
+
+
+class ClientError(Exception):
+    pass
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+class LengthRequired(Exception):
+    pass
@@ -0,0 +1,218 @@
+from collections import OrderedDict
+import json
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from optparse import OptionParser
+import sys
+import threading
+import time
+
+from twoline.client import Client, DEFAULT_TIMEOUT
+from twoline.exceptions import ClientError
+
+
+MAX_WORKERS = 32
+
+# Operation name -> (method, path, number of arguments); the arguments are
+# a message id and/or a message body, in that order.
+OPERATIONS = {
+    'messages': ('GET', '/message/', 0),
+    'message': ('POST', '/message/', 1),
+    'put': ('PUT', '/message/%s/', 2),
+    'patch': ('PATCH', '/message/%s/', 2),
+    'delete': ('DELETE', '/message/%s/', 1),
+    'flash': ('PUT', '/flash/', 1),
+    'unflash': ('DELETE', '/flash/', 0),
+}
+
+
+def request_target(client, method, path, data, picked_up=None):
+    started = time.time()
+    if picked_up is not None:
+        picked_up['at'] = started
+        picked_up['event'].set()
+    result = {
+        'target': str(client),
+        'status': None,
+        'response': None,
+        'error': None,
+    }
+    try:
+        result['status'], result['response'] = client.request(
+            method, path, data
+        )
+        if result['status'] >= 400:
+            result['error'] = 'HTTP %s' % result['status']
+    except ClientError as e:
+        result['error'] = str(e)
+    result['elapsed'] = time.time() - started
+    return result
+
+
+# Sends the same request to many twoline instances at once, keeping one
+# connection per instance open between requests.
+class Fleet(object):
+    def __init__(self, targets, timeout=DEFAULT_TIMEOUT, workers=None):
+        self.timeout = timeout
+        self.clients = OrderedDict(
+            (target, Client(target, timeout)) for target in targets
+        )
+        self.pool = ThreadPool(
+            workers or max(1, min(len(self.clients), MAX_WORKERS))
+        )
+
+    def close(self):
+        self.pool.terminate()
+        for client in self.clients.values():
+            client.close()
+
+    def request(self, method, path, data=None):
+        pending = []
+        for target, client in self.clients.items():
+            picked_up = {'event': threading.Event(), 'at': None}
+            pending.append((target, picked_up, self.pool.apply_async(
+                request_target, (client, method, path, data, picked_up)
+            )))
+        results = []
+        for target, picked_up, pending_result in pending:
+            # Each instance gets the whole timeout from when a worker
+            # picks its request up; with more instances than workers, the
+            # rest wait their turn first.  Waiting in slices keeps the
+            # wait interruptible.
+            while not picked_up['event'].wait(self.timeout):
+                pass
+            remaining = picked_up['at'] + self.timeout - time.time()
+            try:
+                results.append(pending_result.get(max(remaining, 0)))
+            except multiprocessing.TimeoutError:
+                # The abandoned request may still be using the connection,
+                # so the instance gets a new client; the old one's idle
+                # connections are closed.
+                abandoned = self.clients[target]
+                self.clients[target] = Client(target, self.timeout)
+                abandoned.close()
+                results.append({
+                    'target': target,
+                    'status': None,
+                    'response': None,
+                    'error': 'No response within %ss' % self.timeout,
+                    'elapsed': time.time() - picked_up['at'],
+                })
+        return results
+
+    def post_message(self, message):
+        return self.request('POST', '/message/', message)
+
+    def put_message(self, message_id, message):
+        return self.request('PUT', '/message/%s/' % message_id, message)
+
+    def patch_message(self, message_id, message):
+        return self.request('PATCH', '/message/%s/' % message_id, message)
+
+    def delete_message(self, message_id):
+        return self.request('DELETE', '/message/%s/' % message_id)
+
+    def put_flash(self, message):
+        return self.request('PUT', '/flash/', message)
+
+    def delete_flash(self):
+        return self.request('DELETE', '/flash/')
+
+
+def summarize(results):
+    failed = [result for result in results if result['error']]
+    return {
+        'targets': len(results),
+        'succeeded': len(results) - len(failed),
+        'failed': len(failed),
+        'slowest': max(result['elapsed'] for result in results),
+    }
+
+
+def read_targets(path):
+    with open(path, 'r') as in_:
+        for line in in_:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                yield line
+
+
+def main(args=None):
+    parser = OptionParser(
+        usage=(
+            '%%prog fleet [options] OPERATION [ID] [BODY]\n\n'
+            'Operations: %s' % ', '.join(sorted(OPERATIONS))
+        )
+    )
+    parser.add_option(
+        '--target', '-t', dest='targets', action='append', default=[],
+        help='Instance as HOST[:PORT]; may be given more than once',
+    )
+    parser.add_option(
+        '--targets-file', '-f', dest='targets_file', default=None,
+        help='File listing one instance per line',
+    )
+    parser.add_option(
+        '--timeout', dest='timeout', default=str(DEFAULT_TIMEOUT),
+        help='Seconds to wait for each instance',
+    )
+    parser.add_option(
+        '--workers', dest='workers', default=None,
+        help='Number of instances contacted at once',
+    )
+    parser.add_option(
+        '--json', dest='json', action='store_true', default=False,
+        help='Print the results as JSON',
+    )
+    options, args = parser.parse_args(args)
+
+    targets = list(options.targets)
+    if options.targets_file:
+        targets.extend(read_targets(options.targets_file))
+    if not targets:
+        parser.error('At least one target is required')
+    if not args or args[0] not in OPERATIONS:
+        parser.error('Operation required')
+    method, path, arg_count = OPERATIONS[args[0]]
+    if len(args) - 1 != arg_count:
+        parser.error(
+            'Operation \'%s\' takes %s argument(s)' % (args[0], arg_count)
+        )
+
+    data = None
+    if method in ('POST', 'PUT', 'PATCH'):
+        data = args[-1]
+    if '%s' in path:
+        path = path % args[1]
+
+    fleet = Fleet(
+        targets,
+        timeout=float(options.timeout),
+        workers=int(options.workers) if options.workers else None,
+    )
+    try:
+        results = fleet.request(method, path, data)
+    finally:
+        fleet.close()
+    summary = summarize(results)
+
+    if options.json:
+        print(json.dumps(
+            {'results': results, 'summary': summary}, indent=2
+        ))
+    else:
+        for result in results:
+            print('%-24s %-6s %8.1fms %s' % (
+                result['target'],
+                result['status'] or '-',
+                result['elapsed'] * 1000,
+                result['error'] or '',
+            ))
+        print('%(succeeded)s of %(targets)s succeeded; slowest took '
+              '%(slowest).3fs' % summary)
+
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+import unicodedata
+
+import six
+
+
+CUSTOM_CHARACTER_SLOTS = 8
+FALLBACK_CHARACTER = '?'
+
+
+def _bitmap(*rows):
+    return tuple(
+        int(row.replace('.', '0').replace('#', '1'), 2) for row in rows
+    )
+
+
+# Characters present in the HD44780's standard (A00) character ROM; these
+# are written directly and never need a custom character slot.
+ROM_CHARACTERS = {
+    u'→': '\x7e',
+    u'←': '\x7f',
+    u'°': '\xdf',
+    u'ä': '\xe1',
+    u'ß': '\xe2',
+    u'ε': '\xe3',
+    u'µ': '\xe4',
+    u'σ': '\xe5',
+    u'ñ': '\xee',
+    u'ö': '\xef',
+    u'θ': '\xf2',
+    u'∞': '\xf3',
+    u'Ω': '\xf4',
+    u'ü': '\xf5',
+    u'Σ': '\xf6',
+    u'π': '\xf7',
+    u'÷': '\xfd',
+}
+
+# Letters that accents can be drawn onto, six rows tall so that a
+# two-row mark fits above (or below) them in the 5x8 character cell.
+BASE_GLYPHS = {
+    u'a': _bitmap('.....', '.###.', '....#', '.####', '#...#', '.####'),
+    u'c': _bitmap('.....', '.###.', '#....', '#....', '#...#', '.###.'),
+    u'e': _bitmap('.....', '.###.', '#...#', '#####', '#....', '.###.'),
+    u'i': _bitmap('.....', '.##..', '..#..', '..#..', '..#..', '.###.'),
+    u'n': _bitmap('.....', '#.##.', '##..#', '#...#', '#...#', '#...#'),
+    u'o': _bitmap('.....', '.###.', '#...#', '#...#', '#...#', '.###.'),
+    u's': _bitmap('.....', '.####', '#....', '.###.', '....#', '####.'),
+    u'u': _bitmap('.....', '#...#', '#...#', '#...#', '#..##', '.##.#'),
+    u'y': _bitmap('#...#', '#...#', '#...#', '.####', '....#', '.###.'),
+    u'z': _bitmap('.....', '#####', '...#.', '..#..', '.#...', '#####'),
+    u'A': _bitmap('.###.', '#...#', '#...#', '#####', '#...#', '#...#'),
+    u'C': _bitmap('.###.', '#...#', '#....', '#....', '#...#', '.###.'),
+    u'E': _bitmap('#####', '#....', '####.', '#....', '#....', '#####'),
+    u'I': _bitmap('.###.', '..#..', '..#..', '..#..', '..#..', '.###.'),
+    u'N': _bitmap('#...#', '##..#', '#.#.#', '#..##', '#...#', '#...#'),
+    u'O': _bitmap('.###.', '#...#', '#...#', '#...#', '#...#', '.###.'),
+    u'S': _bitmap('.####', '#....', '.###.', '....#', '....#', '####.'),
+    u'U': _bitmap('#...#', '#...#', '#...#', '#...#', '#...#', '.###.'),
+    u'Y': _bitmap('#...#', '#...#', '.#.#.', '..#..', '..#..', '..#..'),
+    u'Z': _bitmap('#####', '....#', '...#.', '..#..', '.#...', '#####'),
+}
+
+# Combining marks drawn above the base letter.
+MARKS_ABOVE = {
+    u'\u0300': _bitmap('.#...', '..#..'),  # grave
+    u'\u0301': _bitmap('...#.', '..#..'),  # acute
+    u'\u0302': _bitmap('..#..', '.#.#.'),  # circumflex
+    u'\u0303': _bitmap('.##.#', '#..#.'),  # tilde
+    u'\u0308': _bitmap('.#.#.', '.....'),  # diaeresis
+    u'\u030a': _bitmap('.###.', '.#.#.'),  # ring
+    u'\u030c': _bitmap('.#.#.', '..#..'),  # caron
+}
+
+# Combining marks drawn below the base letter.
+MARKS_BELOW = {
+    u'\u0327': _bitmap('..#..', '.##..'),  # cedilla
+    u'\u0328': _bitmap('...#.', '...##'),  # ogonek
+}
+
+SYMBOL_GLYPHS = {
+    u'€': _bitmap(
+        '..###', '.#...', '####.', '.#...', '####.', '.#...', '..###', '.....'
+    ),
+    u'£': _bitmap(
+        '..##.', '.#..#', '.#...', '###..', '.#...', '.#..#', '#.##.', '.....'
+    ),
+    u'¢': _bitmap(
+        '..#..', '.####', '#.#..', '#.#..', '#.#..', '.####', '..#..', '.....'
+    ),
+    u'§': _bitmap(
+        '.###.', '#....', '.##..', '#..#.', '.##..', '...#.', '###..', '.....'
+    ),
+    u'✓': _bitmap(
+        '.....', '....#', '...##', '#.##.', '###..', '.#...', '.....', '.....'
+    ),
+    u'♥': _bitmap(
+        '.....', '.#.#.', '#####', '#####', '.###.', '..#..', '.....', '.....'
+    ),
+}
+
+
+_generated = {}
+
+
+# Returns the eight row bitmasks of a 5x8 glyph for ``character``, or
+# ``None`` if it cannot be drawn; accented letters are composed from a
+# base letter and its combining mark.
+def get_glyph(character):
+    if character in _generated:
+        return _generated[character]
+
+    glyph = SYMBOL_GLYPHS.get(character)
+    if glyph is None:
+        decomposed = unicodedata.normalize('NFD', character)
+        base, marks = decomposed[0], decomposed[1:]
+        if base in BASE_GLYPHS and len(marks) == 1:
+            if marks in MARKS_ABOVE:
+                glyph = MARKS_ABOVE[marks] + BASE_GLYPHS[base]
+            elif marks in MARKS_BELOW:
+                glyph = BASE_GLYPHS[base] + MARKS_BELOW[marks]
+
+    _generated[character] = glyph
+    return glyph
+
+
+def get_fallback(character):
+    # Without a glyph, an accented letter still reads better as its bare
+    # ASCII letter than as a question mark.
+    base = unicodedata.normalize('NFD', character)[0]
+    if ord(base) < 128:
+        return str(base)
+    return FALLBACK_CHARACTER
+
+
+# Tracks which characters are loaded into the display's custom character
+# (CGRAM) slots so that glyphs are only uploaded when a page needs one
+# that is not already loaded, evicting the least recently used.
+class GlyphCache(object):
+    def __init__(self, slots=CUSTOM_CHARACTER_SLOTS):
+        self.size = slots
+        self.reset()
+
+    def reset(self):
+        # Character -> slot, least recently used first.
+        self.slots = OrderedDict()
+        self.free = list(range(self.size))
+
+    def _allocate(self, character, keep):
+        if self.free:
+            slot = self.free.pop(0)
+        else:
+            for loaded in self.slots:
+                if loaded not in keep:
+                    slot = self.slots.pop(loaded)
+                    break
+            else:
+                return None
+        self.slots[character] = slot
+        return slot
+
+    def encode(self, text, keep=()):
+        # Returns the bytes to write and the ``(slot, glyph)`` pairs that
+        # must be uploaded before writing them.  Characters in ``keep``
+        # (e.g. those still on screen) are not evicted to make room.
+        if isinstance(text, six.binary_type):
+            text = text.decode('utf-8', 'replace')
+
+        custom = []
+        for character in text:
+            if (
+                ord(character) >= 128
+                and character not in ROM_CHARACTERS
+                and character not in custom
+                and get_glyph(character) is not None
+            ):
+                custom.append(character)
+
+        keep = set(custom) | set(keep)
+        uploads = []
+        for character in custom:
+            if character in self.slots:
+                self.slots[character] = self.slots.pop(character)
+            else:
+                slot = self._allocate(character, keep)
+                if slot is not None:
+                    uploads.append((slot, get_glyph(character)))
+
+        encoded = []
+        for character in text:
+            if ord(character) < 32:
+                encoded.append(' ')
+            elif ord(character) < 128:
+                encoded.append(str(character))
+            elif character in ROM_CHARACTERS:
+                encoded.append(ROM_CHARACTERS[character])
+            elif character in self.slots:
+                encoded.append(chr(self.slots[character]))
+            else:
+                encoded.append(get_fallback(character))
+        return ''.join(encoded), uploads
@@ -0,0 +1,375 @@
+from collections import OrderedDict
+import logging
+import struct
+import time
+
+import six
+from six.moves import cPickle as pickle
+
+from twoline import tracing
+
+
+# Frames exchanged between the web, manager and LCD processes are
+# ``(command, args)`` tuples.  Commands listed in ``COMMANDS`` are packed
+# as a one byte command code followed by a command-specific body; any
+# other command (or arguments a codec cannot represent) is sent as a
+# zero byte, the command name and the pickled arguments.
+GENERIC = 0
+BATCH = 4
+TRACED = 5
+
+DISPLAY_BACKLIGHT = 0x01
+DISPLAY_COLOR = 0x02
+DISPLAY_MARQUEE = 0x04
+DISPLAY_MARQUEE_RATE = 0x08
+
+_header = struct.Struct('!B')
+_color = struct.Struct('!BBB')
+_count = struct.Struct('!H')
+_length = struct.Struct('!I')
+_integer = struct.Struct('!i')
+_rate = struct.Struct('!f')
+_timestamp = struct.Struct('!d')
+
+ACK_TIMEOUT = 10
+
+# Commands the manager repeats every tick to describe what the LCD should
+# show; they are only passed on when they change.
+STATE_COMMANDS = ('message', 'prefetch')
+
+
+logger = logging.getLogger(__name__)
+
+
+def _pack_text(text):
+    if isinstance(text, six.text_type):
+        text = text.encode('utf-8')
+    elif not isinstance(text, six.binary_type):
+        raise TypeError('Expected text, got %r' % (text, ))
+    return _length.pack(len(text)) + text
+
+
+def _unpack_text(data, offset):
+    length, = _length.unpack_from(data, offset)
+    offset += _length.size
+    end = offset + length
+    return data[offset:end].decode('utf-8', 'replace'), end
+
+
+class DisplayCodec(object):
+    # Only the fields the LCD worker acts upon are sent; colors always
+    # arrive as tuples so that repeated frames compare equal.
+    def encode(self, args):
+        message, = args
+        flags = 0
+        body = []
+
+        if message.get('backlight', True):
+            flags |= DISPLAY_BACKLIGHT
+        if message.get('color') is not None:
+            flags |= DISPLAY_COLOR
+            body.append(_color.pack(*message['color']))
+        if message.get('marquee'):
+            flags |= DISPLAY_MARQUEE
+        if message.get('marquee_rate') is not None:
+            flags |= DISPLAY_MARQUEE_RATE
+            body.append(_rate.pack(message['marquee_rate']))
+
+        blink = message.get('blink') or []
+        body.append(_count.pack(len(blink)))
+        body.extend(_color.pack(*color) for color in blink)
+        body.append(_pack_text(message.get('message', '')))
+
+        return _header.pack(flags) + ''.join(body)
+
+    def decode(self, data):
+        flags, = _header.unpack_from(data, 0)
+        offset = _header.size
+        message = {
+            'backlight': bool(flags & DISPLAY_BACKLIGHT),
+        }
+        if flags & DISPLAY_COLOR:
+            message['color'] = _color.unpack_from(data, offset)
+            offset += _color.size
+        if flags & DISPLAY_MARQUEE:
+            message['marquee'] = True
+        if flags & DISPLAY_MARQUEE_RATE:
+            message['marquee_rate'], = _rate.unpack_from(data, offset)
+            offset += _rate.size
+
+        count, = _count.unpack_from(data, offset)
+        offset += _count.size
+        blink = []
+        for _ in range(count):
+            blink.append(_color.unpack_from(data, offset))
+            offset += _color.size
+        if blink:
+            message['blink'] = blink
+
+        message['message'], offset = _unpack_text(data, offset)
+        return [message]
+
+
+class PrefetchCodec(object):
+    def encode(self, args):
+        message, switch_at = args
+        if message is None:
+            return ''
+        return _timestamp.pack(switch_at) + _display.encode([message])
+
+    def decode(self, data):
+        if not data:
+            return [None, None]
+        switch_at, = _timestamp.unpack_from(data, 0)
+        return _display.decode(data[_timestamp.size:]) + [switch_at]
+
+
+class IntegerCodec(object):
+    def encode(self, args):
+        value, = args
+        if not isinstance(value, six.integer_types):
+            raise TypeError('Expected an integer, got %r' % (value, ))
+        return _integer.pack(value)
+
+    def decode(self, data):
+        return list(_integer.unpack(data))
+
+
+class TextCodec(object):
+    def encode(self, args):
+        return _count.pack(len(args)) + ''.join(
+            _pack_text(arg) for arg in args
+        )
+
+    def decode(self, data):
+        count, = _count.unpack_from(data, 0)
+        offset = _count.size
+        args = []
+        for _ in range(count):
+            arg, offset = _unpack_text(data, offset)
+            args.append(arg)
+        return args
+
+
+_display = DisplayCodec()
+_prefetch = PrefetchCodec()
+_integer_args = IntegerCodec()
+_text_args = TextCodec()
+
+# Codes are part of the wire format shared by processes of the same
+# installation; append new commands rather than renumbering, and do not
+# reuse the GENERIC, BATCH or TRACED codes.
+COMMANDS = {
+    # Manager -> LCD
+    'message': (1, _display),
+    'set_brightness': (2, _integer_args),
+    'set_contrast': (3, _integer_args),
+    'prefetch': (6, _prefetch),
+    # Web -> Manager
+    'post_message': (16, _text_args),
+    'put_message_by_id': (17, _text_args),
+    'patch_message_by_id': (18, _text_args),
+    'get_message_by_id': (19, _text_args),
+    'delete_message_by_id': (20, _text_args),
+    'get_messages': (21, _text_args),
+    'put_flash': (22, _text_args),
+    'get_flash': (23, _text_args),
+    'delete_flash': (24, _text_args),
+    'get_tags': (25, _text_args),
+    'get_messages_by_tag': (26, _text_args),
+    'delete_messages_by_tag': (27, _text_args),
+    'patch_messages_by_tag': (28, _text_args),
+}
+CODES = dict(
+    (code, (name, codec)) for name, (code, codec) in COMMANDS.items()
+)
+
+
+def encode(frame, encode_frame=None):
+    cmd, args = frame
+    if cmd == 'batch':
+        sequence, frames = args
+        encode_frame = encode_frame or encode
+        return (
+            _header.pack(BATCH)
+            + _length.pack(sequence)
+            + _count.pack(len(frames))
+            + ''.join(
+                _pack_text(encode_frame(tuple(sub_frame)))
+                for sub_frame in frames
+            )
+        )
+    if cmd == 'traced':
+        trace_id, sent_at, inner_cmd, inner_args = args
+        encode_frame = encode_frame or encode
+        return (
+            _header.pack(TRACED)
+            + _pack_text(trace_id)
+            + _timestamp.pack(sent_at)
+            + encode_frame((inner_cmd, inner_args))
+        )
+    if cmd in COMMANDS:
+        code, codec = COMMANDS[cmd]
+        try:
+            return _header.pack(code) + codec.encode(args)
+        except (TypeError, ValueError, KeyError, struct.error):
+            pass
+    return (
+        _header.pack(GENERIC)
+        + _pack_text(cmd)
+        + pickle.dumps(list(args), pickle.HIGHEST_PROTOCOL)
+    )
+
+
+def decode(data):
+    code, = _header.unpack_from(data, 0)
+    if code == GENERIC:
+        cmd, offset = _unpack_text(data, _header.size)
+        return str(cmd), pickle.loads(data[offset:])
+    if code == BATCH:
+        sequence, = _length.unpack_from(data, _header.size)
+        count, = _count.unpack_from(data, _header.size + _length.size)
+        offset = _header.size + _length.size + _count.size
+        frames = []
+        for _ in range(count):
+            length, = _length.unpack_from(data, offset)
+            offset += _length.size
+            frames.append(list(decode(data[offset:offset + length])))
+            offset += length
+        return 'batch', [sequence, frames]
+    if code == TRACED:
+        trace_id, offset = _unpack_text(data, _header.size)
+        sent_at, = _timestamp.unpack_from(data, offset)
+        cmd, args = decode(data[offset + _timestamp.size:])
+        return 'traced', [str(trace_id), sent_at, cmd, args]
+    cmd, codec = CODES[code]
+    return cmd, codec.decode(data[_header.size:])
+
+
+class Channel(object):
+    # Wraps one end of a ``multiprocessing.Pipe`` so that frames are sent
+    # using ``encode``/``decode`` rather than pickled whole.  The display
+    # state is usually the very same object tick after tick, so its
+    # encoding is kept and reused until a different one is sent.
+    def __init__(self, connection):
+        self.connection = connection
+        self._last_display = None
+        self._last_display_encoded = None
+
+    def encode(self, frame):
+        cmd, args = frame
+        if cmd == 'message' and len(args) == 1:
+            if args[0] is not self._last_display:
+                self._last_display = args[0]
+                self._last_display_encoded = encode(frame)
+            return self._last_display_encoded
+        return encode(frame, self.encode)
+
+    def send(self, frame):
+        self.connection.send_bytes(self.encode(frame))
+
+    def poll(self, timeout=0):
+        return self.connection.poll(timeout)
+
+    def recv(self):
+        return decode(self.connection.recv_bytes())
+
+    def fileno(self):
+        return self.connection.fileno()
+
+    def close(self):
+        self.connection.close()
+
+
+class CoalescingChannel(object):
+    # Manager side of the connection to the LCD worker.  Rather than
+    # writing every frame to the pipe (and eventually blocking when a
+    # stalled device stops the worker from draining it), frames are
+    # collected and sent as a numbered batch only while fewer than
+    # ``window`` batches are awaiting the worker's acknowledgement.
+    # Meanwhile only the newest frame of each command is kept: the latest
+    # display state plus the latest of each control command.
+    def __init__(self, channel, window=1, ack_timeout=ACK_TIMEOUT):
+        self.channel = channel
+        self.window = window
+        self.ack_timeout = ack_timeout
+        self.sequence = 0
+        self.pending = OrderedDict()
+        self.unacknowledged = OrderedDict()
+        self.last_sent_at = None
+        self.last_state = {}
+        # Trace id of the request that caused the pending changes, if any,
+        # and since when they have been pending.
+        self.trace = None
+
+    def send(self, frame):
+        cmd, args = frame
+        if cmd in STATE_COMMANDS and cmd not in self.pending:
+            if args == self.last_state.get(cmd):
+                return
+        self.pending.pop(cmd, None)
+        self.pending[cmd] = args
+        if self.trace is None and tracing.get_current() is not None:
+            self.trace = tracing.get_current(), time.time()
+        self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        if len(self.unacknowledged) >= self.window:
+            if time.time() - self.last_sent_at < self.ack_timeout:
+                return
+            logger.warning(
+                'LCD worker has not acknowledged %s update(s) in %ss; '
+                'resending unacknowledged commands.',
+                len(self.unacknowledged),
+                self.ack_timeout,
+            )
+            self.requeue_unacknowledged()
+
+        self.sequence += 1
+        frames = list(self.pending.items())
+        self.pending.clear()
+        frame = ('batch', [self.sequence, [list(frame) for frame in frames]])
+        if self.trace is not None:
+            trace_id, since = self.trace
+            tracing.record('wait for LCD worker', trace_id, since, time.time())
+            frame = tracing.wrap(frame, trace_id)
+            self.trace = None
+        self.channel.send(frame)
+        self.unacknowledged[self.sequence] = frames
+        self.last_sent_at = time.time()
+        for cmd, args in frames:
+            if cmd in STATE_COMMANDS:
+                self.last_state[cmd] = args
+
+    def requeue_unacknowledged(self):
+        # Control commands are kept until the worker confirms them; the
+        # display state is simply sent again on the manager's next tick.
+        self.last_state.clear()
+        resend = OrderedDict()
+        for frames in self.unacknowledged.values():
+            for cmd, args in frames:
+                if cmd not in STATE_COMMANDS:
+                    resend.pop(cmd, None)
+                    resend[cmd] = args
+        for cmd, args in self.pending.items():
+            resend.pop(cmd, None)
+            resend[cmd] = args
+        self.pending = resend
+        self.unacknowledged.clear()
+
+    def acknowledge(self, sequence):
+        for pending_sequence in list(self.unacknowledged):
+            if pending_sequence <= sequence:
+                del self.unacknowledged[pending_sequence]
+        self.flush()
+
+    def poll(self, timeout=0):
+        return self.channel.poll(timeout)
+
+    def recv(self):
+        return self.channel.recv()
+
+    def fileno(self):
+        return self.channel.fileno()
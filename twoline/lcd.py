@@ -1,11 +1,18 @@
+import errno
 from functools import wraps
 import logging
+import os
 import re
+import select
 import time
 
 import six
 
+from . import glyphs, memory, startup, tracing
+from .clock import Clock
+from .diagnostics import SampledLog, get_events
 from .exceptions import LcdCommandError
+from .glyphs import GlyphCache
 
 
 logger = logging.getLogger(__name__)
@@ -13,18 +20,32 @@ logger = logging.getLogger(__name__)
 
 COMMANDS = {}
 
+DEFAULT_MARQUEE_RATE = 4
+MARQUEE_GAP = 4
+
+WRITE_TIMEOUT = 1.0
+RECONNECT_DELAY = 0.5
+MAX_RECONNECT_DELAY = 30
+
+DISCONNECTED = 'disconnected'
+CONNECTED = 'connected'
+
 
 def command(fn):
+    log_executing = SampledLog(logger)
+    log_response = SampledLog(logger)
+
     @wraps(fn)
     def wrapped(*args):
         self = args[0]
-        logger.debug(
+        log_executing(
             'Executing %s%s',
             fn.func_name,
             args
         )
-        response = fn(*args)
-        logger.debug(
+        with tracing.span(fn.func_name):
+            response = fn(*args)
+        log_response(
             'Response %s',
             response
         )
@@ -34,6 +55,21 @@ def command(fn):
     return fn
 
 
+# Device bytes as shown in the log; only escaped if a record is emitted.
+class Escaped(object):
+    __slots__ = ('data', )
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return self.data.encode('string-escape')
+
+
+def pack_glyph(rows):
+    return ''.join(chr(row) for row in rows)
+
+
 class CallableLcdCommand(object):
     def __init__(self, manager, command):
         self._manager = manager
@@ -106,12 +142,35 @@ class LcdClient(object):
         'cursor_block_off': LcdCommand('\x54', prefix=''),
         'set_backlight_color': LcdCommand('\xd0', args=[chr, chr, chr]),
         'set_lcd_size': LcdCommand('\xd1', args=[chr, chr]),
+        'create_custom_character': LcdCommand(
+            '\x4e', args=[chr, pack_glyph]
+        ),
         'gpo_off': LcdCommand('\x56'),
         'gpo_on': LcdCommand('\x57'),
     }
 
-    def __init__(self, device_path):
+    def __init__(
+        self, device_path, write_timeout=WRITE_TIMEOUT,
+        reconnect_delay=RECONNECT_DELAY,
+        max_reconnect_delay=MAX_RECONNECT_DELAY
+    ):
         self.device_path = device_path
+        self.glyphs = GlyphCache()
+        self._log_send = SampledLog(logger)
+        self._log_dropped = SampledLog(logger, logging.ERROR)
+
+        # The device stays open between commands.  While it is unavailable,
+        # opening it is only retried once the current delay has passed,
+        # doubling the delay after every failure up to the maximum.
+        self.write_timeout = write_timeout
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.state = DISCONNECTED
+        self.fd = None
+        self.retry_delay = reconnect_delay
+        self.retry_at = 0
+        self.attempts = 0
+        self.reconnected = False
 
     def __getattr__(self, name):
         if name not in self.COMMANDS:
@@ -119,21 +178,91 @@ class LcdClient(object):
 
         return CallableLcdCommand(self, self.COMMANDS[name])
 
-    def send(self, cmd):
-        logger.debug(
-            'Sending command: "%s"' % cmd.encode('string-escape')
-        )
+    def connect(self):
+        if self.state == CONNECTED:
+            return True
+        if time.time() < self.retry_at:
+            return False
+        self.attempts += 1
         try:
-            with open(self.device_path, 'wb') as dev:
-                dev.write(cmd)
-        except IOError:
-            logger.error(
-                'Device unavailable; command \'%s\' dropped.',
-                cmd
+            self.fd = os.open(
+                self.device_path,
+                os.O_WRONLY | os.O_NONBLOCK | os.O_NOCTTY
+            )
+        except OSError as e:
+            self.disconnect('cannot be opened (%s)' % e.strerror)
+            return False
+
+        self.state = CONNECTED
+        if self.attempts > 1:
+            # The display may have been power cycled, or was never set up;
+            # whatever was drawn and uploaded before is gone.
+            logger.warning('Device %s reconnected.', self.device_path)
+            self.glyphs.reset()
+            self.reconnected = True
+        return True
+
+    def disconnect(self, reason):
+        if self.fd is not None:
+            try:
+                os.close(self.fd)
+            except OSError:
+                pass
+            self.fd = None
+        logger.error(
+            'Device %s %s; retrying in %.1fs.',
+            self.device_path,
+            reason,
+            self.retry_delay,
+        )
+        self.state = DISCONNECTED
+        self.retry_at = time.time() + self.retry_delay
+        self.retry_delay = min(self.retry_delay * 2, self.max_reconnect_delay)
+
+    def write(self, data):
+        deadline = time.time() + self.write_timeout
+        while data:
+            try:
+                written = os.write(self.fd, data)
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    self.disconnect('write failed (%s)' % e.strerror)
+                    return False
+                written = 0
+            data = data[written:]
+            if not data:
+                break
+            remaining = deadline - time.time()
+            if remaining <= 0 or not select.select(
+                [], [self.fd], [], remaining
+            )[1]:
+                self.disconnect(
+                    'did not accept data within %ss' % self.write_timeout
+                )
+                return False
+        self.retry_delay = self.reconnect_delay
+        return True
+
+    def send(self, cmd):
+        if not self.connect():
+            self._log_dropped(
+                'Device unavailable; command \'%s\' dropped.', Escaped(cmd)
             )
+            return False
+        self._log_send('Sending command: "%s"', Escaped(cmd))
+        with tracing.span('device write', bytes=len(cmd)):
+            return self.write(cmd)
+
+    def prepare_text(self, text, keep=()):
+        # Uploading a custom character moves the display's write address,
+        # so this must happen before positioning the cursor for the text.
+        encoded, uploads = self.glyphs.encode(text, keep)
+        for slot, glyph in uploads:
+            self.create_custom_character(slot, glyph)
+        return encoded
 
     def send_text(self, text):
-        self.send(text.encode('ascii', 'replace'))
+        self.send(self.prepare_text(text))
 
     def __str__(self):
         return 'LCD Screen at {path}'.format(path=self.device_path)
@@ -142,19 +271,23 @@ class LcdClient(object):
 class LcdManager(object):
     def __init__(
         self, device_path, pipe=None, size=None,
-        blink_interval=0.25, text_cycle_interval=2, size_x=16, size_y=2
+        blink_interval=0.25, text_cycle_interval=2, size_x=16, size_y=2,
+        clock=None
     ):
         self.client = LcdClient(device_path)
+        self.clock = clock or Clock()
 
         self.pipe = pipe
         if not size:
-            size = [16, 2]
+            size = [size_x, size_y]
         self.size = size
 
         self.message = ''
         self.message_lines = []
         self.color = 0, 0, 0
         self.backlight = True
+        self.brightness = None
+        self.contrast = None
 
         self.sleep = 0.1
 
@@ -171,42 +304,115 @@ class LcdManager(object):
             (1.0 / self.sleep) * text_cycle_interval
         )
 
+        self.marquee_rate = None
+        self.marquee_frames = []
+        self.marquee_steps = []
+        self.marquee_idx = 0
+        self.marquee_counter = 0
+        self.marquee_interval = 0
+
+        # The message to switch to at ``next_switch_at``, and the write
+        # that draws its first page over the current one.  The write names
+        # the custom character slots of that page, so its characters are
+        # kept loaded until the switch.
+        self.next_message = None
+        self.next_switch_at = None
+        self.next_write = None
+        self.next_keep = frozenset()
+
     def initialize(self):
         self.client.disable_autoscroll()
         self.clear()
 
+    def resync(self):
+        # Redraw the screen from the last known display state after the
+        # device has been reconnected.
+        logger.info('Redrawing display after reconnecting.')
+        self.client.reconnected = False
+        self.client.disable_autoscroll()
+        self.client.clear()
+        # The prefetched write names glyph slots that are now empty.
+        if self.next_message is not None:
+            self.prefetch(self.next_message, self.next_switch_at)
+        if self.brightness is not None:
+            self.client.set_brightness(self.brightness)
+        if self.contrast is not None:
+            self.client.set_contrast(self.contrast)
+        if not self.backlight:
+            self.client.off()
+            return
+        self.client.on(255)
+        if self.blink:
+            self.client.set_backlight_color(*self.blink[self.blink_idx])
+        else:
+            self.client.set_backlight_color(*self.color)
+        if self.marquee_rate:
+            self.set_marquee(self.marquee_rate)
+        else:
+            self.text_idx = 0
+            self.handle_text_cycle()
+
     def run(self):
         while True:
-            if self.pipe.poll():
-                cmd, args = self.pipe.recv()
-                args.insert(0, self)
-                if cmd in COMMANDS:
-                    COMMANDS[cmd](*args)
-                else:
-                    logger.error(
-                        'Received unknown command \'%s\' from manager.',
-                        cmd
-                    )
-                    self.send_manager_data(
-                        'error', 'Command %s does not exist' % cmd
-                    )
-            if self.blink_counter >= self.blink_interval:
-                self.blink_counter = 0
-                self.handle_blink()
-            else:
-                self.blink_counter += 1
-            if self.text_cycle_counter >= self.text_cycle_interval:
-                self.text_cycle_counter = 0
-                self.handle_text_cycle()
+            self.tick()
+            self.wait(self.sleep)
+
+    def wait(self, seconds):
+        # Wakes up early, if need be, to switch to the prefetched message
+        # right on its deadline rather than on the following tick.
+        wake_at = self.clock.time() + seconds
+        if self.next_switch_at is not None and self.next_switch_at < wake_at:
+            self.clock.sleep(max(0, self.next_switch_at - self.clock.time()))
+            self.switch_if_due()
+        self.clock.sleep(max(0, wake_at - self.clock.time()))
+
+    def tick(self):
+        self.switch_if_due()
+        self.handle_pipe()
+        if not self.client.connect():
+            return
+        if self.client.reconnected:
+            self.resync()
+        if self.blink_counter >= self.blink_interval:
+            self.blink_counter = 0
+            self.handle_blink()
+        else:
+            self.blink_counter += 1
+        if self.marquee_steps:
+            if self.marquee_counter >= self.marquee_interval:
+                self.marquee_counter = 0
+                self.handle_marquee()
             else:
-                self.text_cycle_counter += 1
-            time.sleep(self.sleep)
+                self.marquee_counter += 1
+        elif self.text_cycle_counter >= self.text_cycle_interval:
+            self.text_cycle_counter = 0
+            self.handle_text_cycle()
+        else:
+            self.text_cycle_counter += 1
+
+    def handle_pipe(self):
+        if self.pipe.poll():
+            cmd, args = tracing.unwrap(self.pipe.recv())
+            self.dispatch(cmd, args)
+            tracing.set_current(None)
+
+    def dispatch(self, cmd, args):
+        args.insert(0, self)
+        if cmd in COMMANDS:
+            COMMANDS[cmd](*args)
+        else:
+            logger.error(
+                'Received unknown command \'%s\' from manager.',
+                cmd
+            )
+            self.send_manager_data(
+                'error', 'Command %s does not exist' % cmd
+            )
 
     def handle_text_cycle(self):
         if len(self.message_lines) <= self.text_idx:
             self.text_idx = 0
 
-        self.client.cursor_home()
         cleaned_lines = [
             line.ljust(self.size[0])
             for line in self.message_lines[
@@ -216,9 +422,91 @@ class LcdManager(object):
         display_text = ''.join(cleaned_lines)[0:self.size[0]*self.size[1]]
         if not display_text:
             self.off()
-        self.client.send_text(display_text)
+        encoded = self.client.prepare_text(display_text, keep=self.next_keep)
+        self.client.cursor_home()
+        self.client.send(encoded)
+        startup.mark('lcd', 'first frame')
         self.text_idx += 2
 
+    def get_first_page(self, message):
+        lines = self.get_message_lines(
+            message.get('message', '').replace('\n', '')
+        )
+        return ''.join(
+            line.ljust(self.size[0]) for line in lines[0:self.size[1]]
+        ).ljust(self.size[0] * self.size[1])
+
+    def prepare_switch(self, message):
+        # Returns a single write replacing the screen with the first page
+        # of ``message`` without clearing it first, or None if switching
+        # to it needs more than redrawing text and color.
+        if (
+            not message.get('backlight', True)
+            or message.get('blink')
+            or message.get('marquee')
+        ):
+            return None
+        page = self.get_first_page(message)
+
+        data = []
+        color = message.get('color', [255, 255, 255])
+        if color != self.color:
+            data.append(
+                self.client.COMMANDS['set_backlight_color'](*color)
+            )
+        # Glyphs for the page are uploaded now, leaving those still on
+        # screen alone.
+        encoded = self.client.prepare_text(page, keep=self.message)
+        data.append(self.client.COMMANDS['cursor_home']())
+        data.append(encoded)
+        return ''.join(data)
+
+    def switch_if_due(self):
+        if (
+            self.next_switch_at is None
+            or self.clock.time() < self.next_switch_at
+        ):
+            return
+        message, write = self.next_message, self.next_write
+        self.next_message = self.next_switch_at = self.next_write = None
+        self.next_keep = frozenset()
+
+        if write is None or not self.backlight or self.blink or (
+            self.marquee_steps
+        ):
+            LcdManager.message(self, message)
+            return
+
+        self.message = message.get('message', '').replace('\n', '')
+        self.message_lines = self.get_message_lines(self.message)
+        self.text_idx = 2
+        self.text_cycle_counter = 0
+        self.marquee_rate = None
+        self.color = message.get('color', [255, 255, 255])
+        self.client.send(write)
+
+    def handle_marquee(self):
+        step = self.marquee_idx
+        self.marquee_idx = (self.marquee_idx + 1) % len(self.marquee_steps)
+        self.write_regions(
+            self.marquee_steps[step], self.marquee_frames[self.marquee_idx]
+        )
+
+    def write_regions(self, regions, frame):
+        # Positions and text for every region go out in a single write;
+        # any glyph uploads they need are sent ahead of it.  Glyphs shown
+        # anywhere in ``frame``, the screen once written, are kept.
+        keep = set(''.join(frame)) | self.next_keep
+        data = []
+        for col, row, text in regions:
+            encoded = self.client.prepare_text(text, keep=keep)
+            data.append(
+                self.client.COMMANDS['set_cursor_position'](col + 1, row + 1)
+            )
+            data.append(encoded)
+        if data:
+            self.client.send(''.join(data))
+
     def handle_blink(self):
         if not self.blink:
             return
@@ -248,14 +536,111 @@ class LcdManager(object):
             )
         return lines
 
+    def get_marquee_frames(self, message):
+        width, height = self.size
+        lines = re.split('\r|\n', message)[:height]
+        lines.extend([''] * (height - len(lines)))
+        length = max(len(line) for line in lines) + MARQUEE_GAP
+
+        frames = []
+        for offset in range(length):
+            frame = []
+            for line in lines:
+                if len(line) <= width:
+                    frame.append(line.ljust(width))
+                else:
+                    loop = line.ljust(length)
+                    frame.append((loop + loop)[offset:offset + width])
+            frames.append(frame)
+        return frames
+
+    def get_frame_diff(self, before, after):
+        # Returns (column, row, text) regions that turn ``before`` into
+        # ``after``.  Unchanged stretches no longer than a cursor
+        # positioning command are rewritten rather than skipped over.
+        max_gap = len(self.client.COMMANDS['set_cursor_position'](1, 1))
+        regions = []
+        for row, (old, new) in enumerate(zip(before, after)):
+            runs = []
+            for col, (old_char, new_char) in enumerate(zip(old, new)):
+                if old_char == new_char:
+                    continue
+                if runs and col - runs[-1][1] <= max_gap:
+                    runs[-1][1] = col + 1
+                else:
+                    runs.append([col, col + 1])
+            regions.extend((start, row, new[start:end]) for start, end in runs)
+        return regions
+
+    @command
+    def batch(self, sequence, frames):
+        for cmd, args in frames:
+            self.dispatch(cmd, list(args))
+        self.send_manager_data('ack', sequence)
+
+    @command
+    def prefetch(self, message, switch_at):
+        self.next_message = message
+        self.next_switch_at = switch_at
+        self.next_write = None
+        self.next_keep = frozenset()
+        if message is not None:
+            self.next_write = self.prepare_switch(message)
+        if self.next_write is not None:
+            self.next_keep = frozenset(self.get_first_page(message))
+
+    @command
+    def report_events(self, query_id, limit=None):
+        self.send_manager_data('reply', [query_id, get_events(limit)])
+
+    def get_memory_report(self):
+        seen = set()
+        return {
+            'process': memory.get_memory_usage(),
+            'display_bytes': sum(
+                memory.get_size(value, seen) for value in (
+                    self.message, self.message_lines, self.marquee_frames,
+                    self.marquee_steps, self.next_message, self.next_write,
+                    self.next_keep,
+                )
+            ),
+            'glyph_slots_used': len(self.client.glyphs.slots),
+            'glyph_cache_bytes': memory.get_size(glyphs._generated, seen),
+            'event_buffer_bytes': memory.get_size(get_events(), seen),
+            'manager_pipe_bytes': memory.get_pipe_usage(self.pipe),
+        }
+
+    @command
+    def report_memory(self, query_id):
+        self.send_manager_data('reply', [query_id, self.get_memory_report()])
+
+    @command
+    def report_tracemalloc(self, query_id, limit=10, diff=False):
+        self.send_manager_data(
+            'reply', [query_id, memory.get_tracemalloc_report(limit, diff)]
+        )
+
+    @command
+    def start_tracemalloc(self):
+        try:
+            memory.start_tracemalloc()
+        except ValueError as e:
+            logger.warning('Cannot trace allocations: %s', e)
+
+    @command
+    def stop_tracemalloc(self):
+        memory.stop_tracemalloc()
+
     @command
     def set_contrast(self, value):
         logger.debug('Setting contrast to %s', value)
+        self.contrast = value
         self.client.set_contrast(value)
 
     @command
     def set_brightness(self, value):
         logger.debug('Setting brightness to %s', value)
+        self.brightness = value
         self.client.set_brightness(value)
 
     @command
@@ -270,8 +655,15 @@ class LcdManager(object):
             self.off()
             return
 
-        if self.message != text:
-            self.set_message(text)
+        marquee_rate = None
+        if message.get('marquee'):
+            marquee_rate = message.get('marquee_rate', DEFAULT_MARQUEE_RATE)
+
+        if (
+            self.message != text.replace('\n', '')
+            or self.marquee_rate != marquee_rate
+        ):
+            self.set_message(text, marquee_rate)
 
         if blink and self.blink != blink:
             self.set_blink(blink)
@@ -297,13 +689,45 @@ class LcdManager(object):
             self.set_backlight_color(self.blink[self.blink_idx])
 
     @command
-    def set_message(self, message):
+    def set_message(self, message, marquee_rate=None):
         logger.debug('Setting message \'%s\'', message)
         self.clear()
         self.text_idx = 0
         self.message = message.replace('\n', '')
         self.message_lines = self.get_message_lines(self.message)
-        self.handle_text_cycle()
+        if marquee_rate:
+            self.set_marquee(marquee_rate)
+        else:
+            self.handle_text_cycle()
+
+    def set_marquee(self, rate):
+        # Every frame, and the regions that change between consecutive
+        # frames, are computed once here so that each scroll step only
+        # writes the characters that actually moved.
+        self.marquee_rate = rate
+        self.marquee_frames = self.get_marquee_frames(self.message)
+        frame_count = len(self.marquee_frames)
+        self.marquee_steps = [
+            self.get_frame_diff(
+                self.marquee_frames[idx],
+                self.marquee_frames[(idx + 1) % frame_count]
+            )
+            for idx in range(frame_count)
+        ] if frame_count > 1 else []
+        self.marquee_idx = 0
+        self.marquee_counter = 0
+        # Ticks to wait between steps; rates above one step per tick
+        # (refused by the message schema) scroll at one step per tick.
+        self.marquee_interval = max(
+            0, int(round((1.0 / self.sleep) / rate)) - 1
+        )
+        self.write_regions(
+            [
+                (0, row, line)
+                for row, line in enumerate(self.marquee_frames[0])
+            ],
+            self.marquee_frames[0]
+        )
 
     @command
     def off(self, *args):
@@ -322,6 +746,9 @@ class LcdManager(object):
         self.message = ''
         self.text_idx = 0
         self.message_lines = []
+        self.marquee_rate = None
+        self.marquee_frames = []
+        self.marquee_steps = []
         self.client.clear()
 
     @command
@@ -0,0 +1,88 @@
+import json
+from optparse import OptionParser
+import sys
+
+from twoline.client import Client
+from twoline.exceptions import ClientError
+
+
+DEFAULT_TARGET = 'localhost'
+# Loads can take a while to apply; this is how long to wait for the
+# instance between reads rather than for the whole load.
+DEFAULT_TIMEOUT = 60
+READ_SIZE = 65536
+
+
+def read_chunks(in_, size=READ_SIZE):
+    while True:
+        chunk = in_.read(size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def main(args=None):
+    parser = OptionParser(
+        usage=(
+            '%prog load [options] FILE\n\n'
+            'Loads newline-delimited JSON messages from FILE (or - for '
+            'standard input)'
+        )
+    )
+    parser.add_option(
+        '--target', '-t', dest='target', default=DEFAULT_TARGET,
+        help='Instance as HOST[:PORT] or unix:PATH',
+    )
+    parser.add_option(
+        '--timeout', dest='timeout', default=str(DEFAULT_TIMEOUT),
+    )
+    parser.add_option(
+        '--json', dest='json', action='store_true', default=False,
+        help='Print the result as JSON',
+    )
+    options, args = parser.parse_args(args)
+
+    if len(args) != 1:
+        parser.error('Input file required')
+
+    client = Client(options.target, float(options.timeout))
+    in_ = sys.stdin if args[0] == '-' else open(args[0], 'rb')
+    sizes = []
+
+    def chunks():
+        for chunk in read_chunks(in_):
+            sizes.append(len(chunk))
+            yield chunk
+
+    try:
+        status, result = client.load_messages(chunks())
+    except ClientError as e:
+        print(str(e))
+        return 1
+    finally:
+        if in_ is not sys.stdin:
+            in_.close()
+
+    if status != 200:
+        print('Load failed: HTTP %s %s' % (status, result))
+        return 1
+    if sum(sizes) and not result['lines']:
+        print(
+            'Load failed: %s read none of the %s bytes sent'
+            % (client, sum(sizes))
+        )
+        return 1
+    if options.json:
+        print(json.dumps(result, indent=2, sort_keys=True))
+    else:
+        for error in result['errors']:
+            print('Line %(line)s: %(error)s' % error)
+        print(
+            '%(lines)s lines: %(created)s created, %(updated)s updated, '
+            '%(unchanged)s unchanged, %(failed)s failed' % result
+        )
+    return 1 if result['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
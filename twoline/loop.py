@@ -0,0 +1,95 @@
+from collections import deque
+import logging
+import time
+
+from twoline import startup, tracing
+from twoline.capture import TrafficCapture
+from twoline.ipc import CoalescingChannel
+from twoline.memory import log_memory_usage
+from twoline.server import handle_requests, make_servers
+from twoline.web import app
+
+
+logger = logging.getLogger(__name__)
+
+
+# In-process stand-in for one end of a ``multiprocessing.Pipe``.  When
+# polled while empty, ``on_wait`` gives the other side a chance to run
+# instead of spinning on a queue nobody else could ever fill.
+class LocalConnection(object):
+    def __init__(self, inbox, outbox):
+        self._inbox = inbox
+        self._outbox = outbox
+        self.on_wait = None
+
+    def send(self, obj):
+        msg, data = obj
+        self._outbox.append((msg, list(data)))
+
+    def poll(self, timeout=0):
+        if not self._inbox and self.on_wait is not None:
+            self.on_wait()
+        return bool(self._inbox)
+
+    def recv(self):
+        while not self.poll():
+            pass
+        return self._inbox.popleft()
+
+
+def local_pipe():
+    left, right = deque(), deque()
+    return LocalConnection(left, right), LocalConnection(right, left)
+
+
+class SingleProcessLoop(object):
+    def __init__(self, manager):
+        self.manager = manager
+
+        manager.web_pipe, web_pipe = local_pipe()
+        web_pipe.on_wait = manager.handle_web_pipe
+        app.config['PIPE'] = web_pipe
+        if manager.capture:
+            app.config['CAPTURE'] = TrafficCapture(manager.capture)
+
+        lcd_local, lcd_pipe = local_pipe()
+        manager.lcd_pipe = CoalescingChannel(lcd_local)
+        self.lcd = manager.get_lcd_manager(lcd_pipe)
+        # Lets the worker answer the manager's queries while it waits.
+        lcd_local.on_wait = self.lcd.handle_pipe
+
+        self.servers = make_servers(
+            app,
+            manager.ip,
+            manager.port if manager.tcp else None,
+            manager.unix_socket,
+        )
+        startup.mark('web', 'accepting connections')
+
+    def run(self):
+        self.lcd.initialize()
+        startup.mark('lcd', 'device initialized')
+        log_memory_usage('single-process')
+        startup.mark('manager', 'main loop')
+
+        next_manager_tick = next_lcd_tick = time.time()
+        while True:
+            deadlines = [next_manager_tick, next_lcd_tick]
+            if self.lcd.next_switch_at is not None:
+                deadlines.append(self.lcd.next_switch_at)
+            handle_requests(
+                self.servers, max(0, min(deadlines) - time.time())
+            )
+            self.lcd.switch_if_due()
+
+            now = time.time()
+            if now >= next_manager_tick:
+                self.manager.handle_web_pipe()
+                self.manager.handle_lcd_pipe()
+                self.manager.update_screen()
+                tracing.set_current(None)
+                next_manager_tick = now + self.manager.sleep
+            if now >= next_lcd_tick:
+                self.lcd.tick()
+                tracing.set_current(None)
+                next_lcd_tick = now + self.lcd.sleep
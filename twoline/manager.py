@@ -1,5 +1,8 @@
+from collections import defaultdict, OrderedDict
 import datetime
 from functools import wraps
+import importlib
+import itertools
 import json
 import logging
 import multiprocessing
@@ -7,20 +10,35 @@ import os
 import time
 import uuid
 
-from dateutil.parser import parse
-from dateutil.tz import tzlocal
-from jsonschema import validate, ValidationError
-import pytz
+from jsonschema import Draft4Validator, validate, ValidationError
 
 from twoline.exceptions import (
-    InvalidRequest, NotFound, BadRequest, UnexpectedError
+    InvalidRequest, NotFound, BadRequest, QuotaExceeded, UnexpectedError
 )
+from twoline import diagnostics, memory, providers, startup, tracing
+from twoline.admission import AdmissionControl, RateLimiter, REJECT
+from twoline.capture import TrafficCapture
+from twoline.clock import Clock, timestamp
+from twoline.diagnostics import SampledLog
+from twoline.ipc import Channel, CoalescingChannel
 from twoline.lcd import LcdManager
+from twoline.message import Message
 from twoline.schema import message_schema, integer_schema
-from twoline.web import app
 
 
 logger = logging.getLogger(__name__)
+log_flash = SampledLog(logger)
+log_message = SampledLog(logger)
+log_until = SampledLog(logger)
+log_provider_error = SampledLog(logger, logging.ERROR)
+log_lcd_command = SampledLog(logger)
+
+# Built once: ``validate`` checks the schema itself before every message,
+# which costs far more than checking the message.
+message_validator = Draft4Validator(message_schema)
+
+# How long a request waits for the LCD worker to answer a query.
+LCD_REPLY_TIMEOUT = 2
 
 
 WEB_COMMANDS = {}
@@ -37,14 +55,15 @@ def web_command(fn):
             args
         )
         try:
-            response = fn(*args)
+            with tracing.span(fn.func_name):
+                response = fn(*args)
             logger.debug(
                 'Response %s',
                 response
             )
             if response is not None:
                 self.send_web_data('response', response)
-        except NotFound as e:
+        except (NotFound, QuotaExceeded) as e:
             self.send_web_data('error', e)
         except ValidationError as e:
             self.send_web_data('error', InvalidRequest(str(e)))
@@ -66,7 +85,8 @@ def lcd_command(fn):
             fn.func_name,
             args
         )
-        response = fn(*args)
+        with tracing.span(fn.func_name):
+            response = fn(*args)
         logger.debug(
             'Response %s',
             response
@@ -83,6 +103,11 @@ class Manager(object):
         self, device, ip='0.0.0.0', port=9101,
         size_x=16, size_y=2, blink_interval=0.25, text_cycle_interval=2,
         default_message_template=None, default_flash_template=None,
+        single_process=False, provider_modules=None, capture=None,
+        clock=None, unix_socket=None, tcp=True,
+        max_messages=None, max_message_bytes=None,
+        max_messages_per_producer=None, eviction_policy=REJECT,
+        flash_interval=1, flash_rate=None, flash_queue_size=10,
         *args, **kwargs
     ):
         self.ip = ip
@@ -92,14 +117,56 @@ class Manager(object):
         self.size_y = int(size_y)
         self.blink_interval = float(blink_interval)
         self.text_cycle_interval = float(text_cycle_interval)
+        self.single_process = single_process
+        self.capture = capture
+        self.unix_socket = unix_socket
+        self.tcp = tcp
+        self.clock = clock or Clock()
 
-        self.web_pipe, self.web_proc = self.run_webserver()
-        self.lcd_pipe, self.lcd_proc = self.run_lcd()
+        # Importing a provider module registers the providers it defines.
+        for module in (provider_modules or '').split(','):
+            if module.strip():
+                importlib.import_module(module.strip())
 
-        self.no_messages = {
-            'backlight': False,
-            'message': ''
-        }
+        self.web_pipe, self.web_proc = None, None
+        self.lcd_pipe, self.lcd_proc = None, None
+
+        self.flash = None
+        self.flash_until = None
+        self.flash_shown_at = None
+        # Flashes waiting to be shown, by source; each source's newest
+        # replaces any of its own still waiting.
+        self.flash_queue = OrderedDict()
+        self.flash_interval = datetime.timedelta(
+            seconds=float(flash_interval)
+        )
+        self.flash_queue_size = int(flash_queue_size)
+        self.flash_limiter = None
+        if flash_rate:
+            self.flash_limiter = RateLimiter(
+                float(flash_rate), clock=self.clock, name='flashes'
+            )
+        self.lcd_queries = itertools.count(1)
+        # (query id, answer) of the latest reply from the LCD worker
+        self.lcd_reply = None
+        self.messages = []
+        self.messages_by_id = {}
+        # Message id -> index of the message in ``messages``
+        self.message_positions = {}
+        self.tag_index = defaultdict(set)
+        self.admission = AdmissionControl(
+            max_messages=int(max_messages) if max_messages else None,
+            max_bytes=int(max_message_bytes) if max_message_bytes else None,
+            max_per_producer=(
+                int(max_messages_per_producer)
+                if max_messages_per_producer else None
+            ),
+            policy=eviction_policy,
+        )
+        self._message_id = None
+        self.until = None
+
+        self.no_messages = Message(backlight=False, message='')
         self.default_message = self._read_config_json_or_default(
             default_message_template,
             {
@@ -116,11 +183,6 @@ class Manager(object):
                 'timeout': 10
             }
         )
-        self.flash = None
-        self.flash_until = None
-        self.messages = []
-        self._message_id = None
-        self.until = None
 
         self.sleep = 0.2
 
@@ -137,6 +199,29 @@ class Manager(object):
         # Otherwise, try parsing it as JSON directly
         return json.loads(json_file_or_string)
 
+    @property
+    def default_message(self):
+        return self._default_message
+
+    @default_message.setter
+    def default_message(self, value):
+        self._default_message = value
+        self.no_messages.resolve(value)
+        for message in self.messages:
+            message.resolve(value)
+
+    @property
+    def default_flash(self):
+        return self._default_flash
+
+    @default_flash.setter
+    def default_flash(self, value):
+        self._default_flash = value
+        if self.flash:
+            self.flash.resolve(value)
+        for queued in self.flash_queue.values():
+            queued.resolve(value)
+
     @property
     def message_id(self):
         return self._message_id
@@ -146,112 +231,208 @@ class Manager(object):
         logger.debug('Setting message_id to %s', self._message_id)
         self._message_id = value
 
+    def start(self):
+        self.web_pipe, self.web_proc = self.run_webserver()
+        self.lcd_pipe, self.lcd_proc = self.run_lcd()
+
+    def terminate(self):
+        for process in (self.lcd_proc, self.web_proc):
+            if process is None:
+                continue
+            try:
+                process.terminate()
+            except Exception as e:
+                logger.exception(e)
+
     def run(self):
+        if self.single_process:
+            from twoline.loop import SingleProcessLoop
+            loop = SingleProcessLoop(self)
+        else:
+            self.start()
         logger.info(
             'Listening on http://%s:%s',
             self.ip,
             self.port
         )
+        if not self.single_process:
+            memory.log_memory_usage('manager')
         try:
-            self._run()
+            if self.single_process:
+                loop.run()
+            else:
+                self._run()
         except Exception as e:
             logger.exception(e)
-            try:
-                self.lcd_proc.terminate()
-            except Exception as e:
-                logger.exception(e)
-            try:
-                self.web_proc.terminate()
-            except Exception as e:
-                logger.exception(e)
+            self.terminate()
 
     def _run(self):
         logger.debug("Waiting for data")
+        startup.mark('manager', 'main loop')
+        while True:
+            self.handle_web_pipe()
+            self.handle_lcd_pipe()
+            self.wait(self.sleep)
+            self.update_screen()
+            # Changes made on behalf of a traced request have been passed
+            # on to the LCD worker by now.
+            tracing.set_current(None)
+
+    def wait(self, seconds):
+        # Answers web requests as they arrive rather than on the next
+        # tick, so that a client sending several in turn (such as a bulk
+        # load) is not held up a tick for each.
+        wake_at = self.clock.time() + seconds
         while True:
-            if self.web_pipe.poll():
-                cmd, args = self.web_pipe.recv()
-                args.insert(0, self)
-                logger.debug(
-                    "Data received from WEB %s:%s",
+            remaining = wake_at - self.clock.time()
+            if remaining <= 0 or not self.web_pipe.poll(remaining):
+                break
+            self.handle_web_pipe()
+        self.clock.sleep(max(0, wake_at - self.clock.time()))
+
+    def handle_web_pipe(self):
+        if self.web_pipe.poll():
+            cmd, args = tracing.unwrap(self.web_pipe.recv())
+            args.insert(0, self)
+            logger.debug(
+                "Data received from WEB %s:%s",
+                cmd,
+                args
+            )
+            if cmd in WEB_COMMANDS:
+                logger.info(
+                    'WEB Command Received %s%s',
                     cmd,
                     args
                 )
-                if cmd in WEB_COMMANDS:
-                    logger.info(
-                        'WEB Command Received %s%s',
-                        cmd,
-                        args
-                    )
-                    WEB_COMMANDS[cmd](*args)
-                else:
-                    logger.error(
-                        'Received unknown command \'%s\' from web.',
-                        cmd
-                    )
-                    self.send_web_data(
-                        'error', 'Command %s does not exist' % cmd
-                    )
-            if self.lcd_pipe.poll():
-                cmd, args = self.lcd_pipe.recv()
-                args.insert(0, self)
-                logger.debug(
-                    "Data received from LCD %s:%s",
+                WEB_COMMANDS[cmd](*args)
+            else:
+                logger.error(
+                    'Received unknown command \'%s\' from web.',
+                    cmd
+                )
+                self.send_web_data(
+                    'error', 'Command %s does not exist' % cmd
+                )
+
+    def handle_lcd_pipe(self):
+        while self.lcd_pipe.poll():
+            cmd, args = tracing.unwrap(self.lcd_pipe.recv())
+            args.insert(0, self)
+            if cmd in LCD_COMMANDS:
+                log_lcd_command(
+                    'LCD Command Received %s%s',
                     cmd,
                     args
                 )
-                if cmd in LCD_COMMANDS:
-                    logger.info(
-                        'LCD Command Received %s%s',
-                        cmd,
-                        args
-                    )
-                    WEB_COMMANDS[cmd](*args)
-                else:
-                    logger.error(
-                        'Received unknown command \'%s\' from lcd.',
-                        cmd
-                    )
-                    self.send_lcd_data(
-                        'error', 'Command %s does not exist' % cmd
-                    )
-            time.sleep(self.sleep)
-            self.update_screen()
+                LCD_COMMANDS[cmd](*args)
+            else:
+                logger.error(
+                    'Received unknown command \'%s\' from lcd.',
+                    cmd
+                )
+                self.send_lcd_data(
+                    'error', 'Command %s does not exist' % cmd
+                )
+
+    def query_lcd(self, cmd, args=None):
+        # Sends ``cmd`` to the LCD worker and waits for its answer, which
+        # is None if the worker does not reply in time.  Other commands
+        # from the worker are handled as usual in the meantime.
+        query_id = next(self.lcd_queries)
+        self.send_lcd_data(cmd, [query_id] + list(args or []))
+        deadline = time.time() + LCD_REPLY_TIMEOUT
+        while True:
+            self.handle_lcd_pipe()
+            if self.lcd_reply is not None and self.lcd_reply[0] == query_id:
+                answer = self.lcd_reply[1]
+                self.lcd_reply = None
+                return answer
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                logger.warning(
+                    'LCD worker did not answer %s within %ss',
+                    cmd,
+                    LCD_REPLY_TIMEOUT,
+                )
+                return None
+            self.lcd_pipe.poll(remaining)
 
     def get_flash_message(self):
-        original_message = self.flash
-        logger.debug("Original Flash: %s", original_message)
-        default = self.default_flash.copy()
-        default.update(
-            original_message
-        )
-        logger.debug("Final Flash: %s", default)
-        return default
+        flash = self.flash.resolved
+        log_flash("Final Flash: %s", flash)
+        return flash
 
     def get_message(self):
         if not self.message_id and self.messages:
-            self.message_id = self.messages[0]['id']
+            self.message_id = self.messages[0].id
         idx = self.get_message_index_by_id(self.message_id)
-        original_message = self.messages[idx]
-        logger.debug("Original Message: %s", original_message)
-        default = self.default_message.copy()
-        default.update(
-            original_message
-        )
-        logger.debug("Final Message: %s", default)
-        return default
+        message = self.messages[idx].resolved
+        log_message("Final Message: %s", message)
+        return message
 
     def get_no_messages_message(self):
-        message = self.no_messages
-        default = self.default_message.copy()
-        default.update(
-            message
-        )
-        return default
+        return self.no_messages.resolved
 
     def get_message_index_by_id(self, id_):
-        for message in self.messages:
-            if message['id'] == id_:
-                return self.messages.index(message)
+        return self.message_positions.get(id_)
+
+    def get_message_ids_by_tag(self, tag):
+        ids = self.tag_index.get(tag)
+        if not ids:
+            raise NotFound('Tag %s does not exist' % tag)
+        # Keep rotation order so responses are stable.
+        return sorted(ids, key=self.message_positions.__getitem__)
+
+    def index_message(self, message):
+        self.messages_by_id[message.id] = message
+        for tag in message.tags or []:
+            self.tag_index[tag].add(message.id)
+
+    def unindex_message(self, message):
+        self.messages_by_id.pop(message.id, None)
+        self.admission.remove(message.id)
+        for tag in message.tags or []:
+            ids = self.tag_index.get(tag)
+            if ids is None:
+                continue
+            ids.discard(message.id)
+            if not ids:
+                del self.tag_index[tag]
+
+    def store_message(self, message, producer=None):
+        idx = self.get_message_index_by_id(message.id)
+        if idx is None:
+            self.message_positions[message.id] = len(self.messages)
+            self.messages.append(message)
+        else:
+            self.unindex_message(self.messages[idx])
+            self.messages[idx] = message
+        self.index_message(message)
+        self.admission.add(message, producer)
+        return message
+
+    def admit_message(self, message, producer=None):
+        return self.admit_messages([message], producer)[0]
+
+    def admit_messages(self, messages, producer=None):
+        # Makes room for all of ``messages`` as the admission policy allows
+        # (or raises ``QuotaExceeded``, storing none of them), then stores
+        # them.
+        evicted = self.admission.admit_all(messages, producer)
+        for id_ in evicted:
+            logger.info(
+                'Evicting message %s to make room for %s message(s)',
+                id_,
+                len(messages),
+            )
+        if evicted:
+            self.delete_messages(evicted)
+        return [self.store_message(message, producer) for message in messages]
+
+    def is_unchanged(self, record):
+        existing = self.messages_by_id.get(record.id)
+        return existing is not None and existing.digest() == record.digest()
 
     def increment_index(self):
         if self.message_id:
@@ -261,7 +442,7 @@ class Manager(object):
         else:
             current_index = 0
         self.until = None
-        self.message_id = self.messages[current_index]['id']
+        self.message_id = self.messages[current_index].id
         logger.debug(
             'Incrementing: Index: %s: %s',
             current_index,
@@ -269,57 +450,110 @@ class Manager(object):
         )
 
     def delete_message(self, message_id):
-        if self.message_id == message_id:
-            self.increment_index()
-            if self.message_id == message_id:
-                # If we just incremented, and are still at the same index
-                # there is only one message in the list, and we're
-                # in the process of deleting it.
-                self.until = None
-                self.message_id = None
-        idx = self.get_message_index_by_id(message_id)
-        message = self.messages[idx]
-        self.messages.remove(message)
+        self.delete_messages([message_id])
+
+    def delete_messages(self, message_ids):
+        # Removes all of ``message_ids`` in one pass over the messages
+        # following the first of them, however many there are.
+        message_ids = set(message_ids)
+        if self.message_id in message_ids:
+            # Move on to the next message that is staying, if any.
+            idx = self.message_positions[self.message_id]
+            count = len(self.messages)
+            self.until = None
+            self.message_id = None
+            offset = 1
+            while offset < count:
+                candidate = self.messages[(idx + offset) % count].id
+                if candidate not in message_ids:
+                    self.message_id = candidate
+                    break
+                offset += 1
+        first = min(self.message_positions[id_] for id_ in message_ids)
+        kept = []
+        for message in self.messages[first:]:
+            if message.id in message_ids:
+                self.message_positions.pop(message.id)
+                self.unindex_message(message)
+            else:
+                kept.append(message)
+        del self.messages[first:]
+        self.messages.extend(kept)
+        for idx, message in enumerate(kept, first):
+            self.message_positions[message.id] = idx
 
     def handle_expirations(self):
-        utcnow = datetime.datetime.utcnow().replace(tzinfo=pytz.UTC)
+        utcnow = self.clock.utcnow()
+        expired = []
         for message in self.messages:
-            if 'expires' in message and message['expires'] < utcnow:
+            if message.expires is not None and message.expires < utcnow:
                 logger.info(
                     'Message %s has expired.',
-                    message['id']
+                    message.id
                 )
-                self.delete_message(message['id'])
-        logger.debug('Flash Until: %s', self.flash_until)
-        logger.debug('Message Until: %s', self.until)
+                expired.append(message.id)
+        if expired:
+            self.delete_messages(expired)
+        log_until(
+            'Flash Until: %s; Message Until: %s',
+            self.flash_until,
+            self.until
+        )
         if self.flash and self.flash_until and self.flash_until < utcnow:
             logger.info('Flash message has expired')
             self.flash = None
             self.flash_until = None
+        elif self.flash and self.flash_until and self.flash_queue and (
+            self.flash_shown_at + self.flash_interval <= utcnow
+        ):
+            # Others are waiting; this one has been shown long enough.
+            self.flash = None
+            self.flash_until = None
+        if not self.flash and self.flash_queue:
+            _, self.flash = self.flash_queue.popitem(last=False)
         if self.messages:
             if self.until and self.until < utcnow:
                 self.increment_index()
 
     def get_current_message(self):
-        utcnow = datetime.datetime.utcnow().replace(tzinfo=pytz.UTC)
+        utcnow = self.clock.utcnow()
         self.handle_expirations()
         if self.flash:
             flash = self.get_flash_message()
             if not self.flash_until:
+                self.flash_shown_at = utcnow
                 self.flash_until = (
                     utcnow + datetime.timedelta(seconds=flash['timeout'])
                 )
-            return flash
+            return self.render_message(flash)
         elif self.messages:
             message = self.get_message()
             if not self.until:
                 self.until = (
                     utcnow + datetime.timedelta(seconds=message['interval'])
                 )
-            return message
+            return self.render_message(message)
         else:
             return self.get_no_messages_message()
 
+    def render_message(self, message):
+        # Provider content is only produced for the message about to be
+        # displayed, and each provider caches its value for its own TTL.
+        if 'provider' not in message:
+            return message
+        rendered = message.copy()
+        try:
+            rendered['message'] = providers.render(
+                message.get('message'), message['provider']
+            )
+        except Exception as e:
+            log_provider_error(
+                'Provider %s failed: %s', message['provider'], e
+            )
+            rendered['message'] = message.get('message', '')
+        return rendered
+
+    @tracing.traced
     def update_screen(self):
         try:
             message = self.get_current_message()
@@ -337,6 +571,29 @@ class Manager(object):
             'message', message
         )
 
+        # Let the LCD worker lay out the next message in advance so that
+        # it can switch to it right when ``until`` passes.
+        upcoming = self.get_upcoming_message()
+        if upcoming is None:
+            self.send_lcd_data('prefetch', [None, None])
+        else:
+            self.send_lcd_data(
+                'prefetch', [upcoming, timestamp(self.until)]
+            )
+
+    def get_upcoming_message(self):
+        # The message rotation will move on to once ``until`` passes, if
+        # nothing (a flash, or the message expiring first) intervenes.
+        if self.flash or not self.until or len(self.messages) < 2:
+            return None
+        idx = self.get_message_index_by_id(self.message_id)
+        if idx is None:
+            return None
+        upcoming = self.messages[(idx + 1) % len(self.messages)]
+        if upcoming.expires is not None and upcoming.expires <= self.until:
+            return None
+        return self.render_message(upcoming.resolved)
+
     def send_lcd_data(self, msg, data=None):
         if not data:
             data = []
@@ -355,49 +612,69 @@ class Manager(object):
             msg, data
         ))
 
+    def get_lcd_manager(self, pipe):
+        return LcdManager(
+            self.device,
+            pipe,
+            size_x=self.size_x,
+            size_y=self.size_y,
+            blink_interval=self.blink_interval,
+            text_cycle_interval=self.text_cycle_interval,
+            clock=self.clock,
+        )
+
     def run_lcd(self):
         local, lcd_pipe = multiprocessing.Pipe()
 
         def _run_lcd():
-            mgr = LcdManager(
-                self.device,
-                lcd_pipe,
-                size_x=self.size_x,
-                size_y=self.size_y,
-                blink_interval=self.blink_interval,
-                text_cycle_interval=self.text_cycle_interval
-            )
+            mgr = self.get_lcd_manager(Channel(lcd_pipe))
             mgr.initialize()
+            startup.mark('lcd', 'device initialized')
+            memory.log_memory_usage('lcd')
             mgr.run()
 
         process = multiprocessing.Process(
-            target=_run_lcd
+            target=_run_lcd,
+            name='lcd'
         )
         process.start()
         logger.debug(
             'Started LCD on pid %s',
             process.pid
         )
-        return local, process
+        return CoalescingChannel(Channel(local)), process
 
     def run_webserver(self):
         local, webserver = multiprocessing.Pipe()
 
         def _run_webserver():
-            app.config['PIPE'] = webserver
-            app.run(
-                host=self.ip,
-                port=int(self.port),
+            # Only the web process needs Flask; importing it here keeps it
+            # out of the manager and LCD processes entirely.
+            from twoline.server import make_servers, serve_forever
+            from twoline.web import app
+            startup.mark('web', 'imports loaded')
+            app.config['PIPE'] = Channel(webserver)
+            if self.capture:
+                app.config['CAPTURE'] = TrafficCapture(self.capture)
+            servers = make_servers(
+                app,
+                self.ip,
+                self.port if self.tcp else None,
+                self.unix_socket,
             )
+            startup.mark('web', 'accepting connections')
+            memory.log_memory_usage('web')
+            serve_forever(servers)
         process = multiprocessing.Process(
-            target=_run_webserver
+            target=_run_webserver,
+            name='web'
         )
         process.start()
         logger.debug(
             'Started WEB on pid %s',
             process.pid
         )
-        return local, process
+        return Channel(local), process
 
     def _get_message_from_string(self, message):
         try:
@@ -412,20 +689,32 @@ class Manager(object):
                 "message": message,
             }
 
-    def process_message(self, message, ignore_id=False):
+    @tracing.traced
+    def process_message(self, message, ignore_id=False, defaults=None):
         if 'expires' in message:
             if isinstance(message['expires'], datetime.datetime):
                 message['expires'] = message['expires'].isoformat()
-        validate(message, message_schema)
+        message_validator.validate(message)
+        if 'provider' in message and (
+            message['provider'] not in providers.PROVIDERS
+        ):
+            raise ValidationError(
+                'Unknown provider \'%s\'; available providers: %s' % (
+                    message['provider'],
+                    ', '.join(sorted(providers.PROVIDERS)),
+                )
+            )
         if not 'id' in message or ignore_id:
             message['id'] = uuid.uuid4().hex
         if 'expires' in message:
             if isinstance(message['expires'], int):
                 message['expires'] = (
-                    datetime.datetime.utcnow().replace(tzinfo=pytz.UTC)
+                    self.clock.utcnow()
                     + datetime.timedelta(seconds=message['expires'])
                 )
             elif isinstance(message['expires'], basestring):
+                from dateutil.parser import parse
+                from dateutil.tz import tzlocal
                 try:
                     expires = parse(message['expires'])
                     if not expires.tzinfo:
@@ -445,46 +734,85 @@ class Manager(object):
                         'count of seconds'
                     ) % message['expires']
                 )
-        return message
+        if defaults is None:
+            defaults = self.default_message
+        return Message.from_dict(message, defaults)
+
+    def patch_message(self, id_, message):
+        original_message = self.messages_by_id[id_].to_dict()
+        original_message.update(message)
+        original_message['id'] = id_
+        return self.process_message(original_message)
 
     @web_command
     def get_message_by_id(self, id_):
-        idx = self.get_message_index_by_id(id_)
-        if idx is None:
+        if id_ not in self.messages_by_id:
             raise NotFound('Message %s does not exist' % id_)
-        return self.messages[idx]
+        return self.messages_by_id[id_].to_dict()
 
     @web_command
     def delete_message_by_id(self, id_):
-        idx = self.get_message_index_by_id(id_)
-        if idx is None:
+        if id_ not in self.messages_by_id:
             raise NotFound('Message %s does not exist' % id_)
         self.delete_message(id_)
         return 'OK'
 
     @web_command
-    def put_message_by_id(self, id_, message_payload):
+    def put_message_by_id(self, id_, message_payload, producer=None):
         message = self._get_message_from_string(message_payload)
-        idx = self.get_message_index_by_id(id_)
-        if idx is None:
-            message['id'] = id_
-            self.messages.append(self.process_message(message))
-            return message
-        else:
-            self.messages[idx] = self.process_message(message)
-            self.messages[idx]['id'] = id_
-            return self.messages[idx]
+        message['id'] = id_
+        record = self.process_message(message)
+        # Identical writes leave the stored record, and so the display,
+        # untouched.
+        if self.is_unchanged(record):
+            return [self.messages_by_id[id_].to_dict(), True]
+        return [self.admit_message(record, producer).to_dict(), False]
 
     @web_command
-    def patch_message_by_id(self, id_, message_payload):
+    def patch_message_by_id(self, id_, message_payload, producer=None):
         message = self._get_message_from_string(message_payload)
-        idx = self.get_message_index_by_id(id_)
-        if idx is None:
+        if id_ not in self.messages_by_id:
             raise NotFound('Message %s does not exist' % id_)
-        original_message = self.messages[idx]
-        original_message.update(message)
-        self.messages[idx] = self.process_message(original_message)
-        return self.messages[idx]
+        record = self.patch_message(id_, message)
+        if self.is_unchanged(record):
+            return [self.messages_by_id[id_].to_dict(), True]
+        return [self.admit_message(record, producer).to_dict(), False]
+
+    @web_command
+    def get_tags(self, *args):
+        return [
+            dict((tag, len(ids)) for tag, ids in self.tag_index.items())
+        ]
+
+    @web_command
+    def get_messages_by_tag(self, tag):
+        return [
+            self.messages_by_id[id_].to_dict()
+            for id_ in self.get_message_ids_by_tag(tag)
+        ]
+
+    @web_command
+    def delete_messages_by_tag(self, tag):
+        ids = self.get_message_ids_by_tag(tag)
+        self.delete_messages(ids)
+        return len(ids)
+
+    @web_command
+    def patch_messages_by_tag(self, tag, message_payload, producer=None):
+        message = self._get_message_from_string(message_payload)
+        # Validate and admit every patched message before storing any of
+        # them so that a patch is applied either wholly or not at all.
+        records = [
+            self.patch_message(id_, message)
+            for id_ in self.get_message_ids_by_tag(tag)
+        ]
+        self.admit_messages(
+            [record for record in records if not self.is_unchanged(record)],
+            producer
+        )
+        return [
+            self.messages_by_id[record.id].to_dict() for record in records
+        ]
 
     @web_command
     def set_brightness(self, value):
@@ -512,39 +840,168 @@ class Manager(object):
 
     @web_command
     def get_messages(self, *args):
-        return self.messages
+        return [message.to_dict() for message in self.messages]
 
     @web_command
-    def post_message(self, message_payload):
+    def post_message(self, message_payload, producer=None):
         message = self._get_message_from_string(message_payload)
-        self.messages.append(
-            self.process_message(
-                message,
-                ignore_id=True
-            )
+        record = self.process_message(
+            message,
+            ignore_id=True
         )
-        return message
+        return self.admit_message(record, producer).to_dict()
 
     @web_command
-    def put_flash(self, message_payload):
-        self.flash = self.process_message(
+    def load_messages(self, first_line, lines, producer=None):
+        # Applies JSON-lines input one line at a time; lines naming an id
+        # replace that message.  A bad line is reported and skipped.
+        result = {
+            'created': 0,
+            'updated': 0,
+            'unchanged': 0,
+            'failed': 0,
+            'errors': [],
+        }
+        for number, line in enumerate(lines, first_line):
+            if line is not None and not line.strip():
+                continue
+            try:
+                if line is None:
+                    raise ValueError('Line is too long')
+                message = json.loads(line)
+                if not isinstance(message, dict):
+                    raise ValueError('Expected a JSON object')
+                record = self.process_message(message)
+                if self.is_unchanged(record):
+                    result['unchanged'] += 1
+                    continue
+                existed = record.id in self.messages_by_id
+                self.admit_message(record, producer)
+                result['updated' if existed else 'created'] += 1
+            except ValidationError as e:
+                result['failed'] += 1
+                result['errors'].append({'line': number, 'error': e.message})
+            except (ValueError, QuotaExceeded) as e:
+                result['failed'] += 1
+                result['errors'].append({'line': number, 'error': str(e)})
+        return result
+
+    @web_command
+    def put_flash(self, message_payload, producer=None):
+        record = self.process_message(
             self._get_message_from_string(
                 message_payload
-            )
+            ),
+            defaults=self.default_flash
         )
-        return self.get_flash_message()  # Post-processing
+        digest = record.digest()
+        if self.flash is not None and self.flash.digest() == digest:
+            return [self.get_flash_message(), True]
+        for queued in self.flash_queue.values():
+            if queued.digest() == digest:
+                return [queued.resolved, True]
+        if self.flash_limiter is not None:
+            self.flash_limiter.check(producer)
+
+        if self.flash is None:
+            self.flash = record
+            return [self.get_flash_message(), False]  # Post-processing
+        # The flash on screen stays for at least ``flash_interval``, so
+        # however many arrive, the display changes at most that often.
+        self.flash_queue.pop(producer, None)
+        self.flash_queue[producer] = record
+        if len(self.flash_queue) > self.flash_queue_size:
+            source, dropped = self.flash_queue.popitem(last=False)
+            logger.warning(
+                'Flash queue is full; dropping flash %s from %s',
+                dropped.id,
+                source,
+            )
+        return [record.resolved, False]
 
     @web_command
     def delete_flash(self):
         self.flash = None
         self.flash_until = None
+        self.flash_queue.clear()
         return 'OK'
 
     @web_command
     def get_flash(self):
         if not self.flash:
             raise NotFound('Flash message not set')
-        return self.flash
+        return self.flash.to_dict()
+
+    @web_command
+    def get_events(self, limit=None):
+        return diagnostics.merge_events(
+            diagnostics.get_events(limit),
+            self.query_lcd('report_events', [limit]),
+        )
+
+    def get_memory_report(self):
+        seen = set()
+        report = {
+            'process': memory.get_memory_usage(),
+            'messages': len(self.messages),
+            'message_store_bytes': sum(
+                memory.get_size(value, seen) for value in (
+                    self.messages, self.messages_by_id, self.tag_index,
+                )
+            ),
+            'flash_bytes': memory.get_size(
+                [self.flash, self.flash_queue], seen
+            ),
+            'provider_cache_bytes': memory.get_size(
+                [cached.value for cached in providers.PROVIDERS.values()],
+                seen
+            ),
+            'event_buffer_bytes': memory.get_size(
+                diagnostics.get_events(), seen
+            ),
+            'web_pipe_bytes': memory.get_pipe_usage(self.web_pipe),
+            'lcd_pipe_bytes': memory.get_pipe_usage(self.lcd_pipe),
+        }
+        if isinstance(self.lcd_pipe, CoalescingChannel):
+            report['lcd_pending_commands'] = len(self.lcd_pipe.pending)
+            report['lcd_unacknowledged_batches'] = len(
+                self.lcd_pipe.unacknowledged
+            )
+        return report
+
+    @web_command
+    def get_memory(self):
+        return {
+            'manager': self.get_memory_report(),
+            'lcd': self.query_lcd('report_memory'),
+        }
+
+    @web_command
+    def get_tracemalloc(self, limit=10, diff=False):
+        return {
+            'manager': memory.get_tracemalloc_report(limit, diff),
+            'lcd': self.query_lcd('report_tracemalloc', [limit, diff]),
+        }
+
+    @web_command
+    def start_tracemalloc(self):
+        memory.start_tracemalloc()
+        self.send_lcd_data('start_tracemalloc')
+        return 'OK'
+
+    @web_command
+    def stop_tracemalloc(self):
+        memory.stop_tracemalloc()
+        self.send_lcd_data('stop_tracemalloc')
+        return 'OK'
+
+    @lcd_command
+    def ack(self, sequence):
+        self.lcd_pipe.acknowledge(sequence)
+
+    @lcd_command
+    def reply(self, query_id, answer):
+        self.lcd_reply = query_id, answer
 
     @lcd_command
     @web_command
@@ -0,0 +1,157 @@
+from array import array
+from collections import deque
+import fcntl
+import logging
+import os
+import resource
+import sys
+import termios
+
+try:
+    import tracemalloc
+except ImportError:
+    # Only available from Python 3.4.
+    tracemalloc = None
+
+
+logger = logging.getLogger(__name__)
+
+
+def _read_proc_kb(path, field):
+    try:
+        with open(path, 'r') as in_:
+            for line in in_:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+def get_memory_usage():
+    # Forked children share most of their pages with the parent, so RSS
+    # alone overstates what each process costs; PSS (where the kernel
+    # provides it) splits shared pages between the processes using them.
+    rss = _read_proc_kb('/proc/self/status', 'VmRSS')
+    if rss is None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        'pid': os.getpid(),
+        'rss_kb': rss,
+        'pss_kb': _read_proc_kb('/proc/self/smaps_rollup', 'Pss'),
+    }
+
+
+def log_memory_usage(process_name):
+    usage = get_memory_usage()
+    logger.info(
+        'Memory usage of %s process (pid %s): RSS %s kB, PSS %s kB',
+        process_name,
+        usage['pid'],
+        usage['rss_kb'],
+        usage['pss_kb'] if usage['pss_kb'] is not None else 'unknown',
+    )
+    return usage
+
+
+def get_size(obj, seen=None):
+    # Approximate number of bytes held by ``obj`` and everything it
+    # references, counting objects already in ``seen`` (shared between
+    # calls to avoid counting anything twice) only once.
+    if seen is None:
+        seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            stack.extend(obj)
+        elif hasattr(obj, '__slots__'):
+            stack.extend(
+                getattr(obj, slot) for slot in obj.__slots__
+                if hasattr(obj, slot)
+            )
+        elif hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+    return total
+
+
+def get_pipe_usage(connection):
+    # Bytes sent by the other end of ``connection`` but not yet read.
+    try:
+        fd = connection.fileno()
+    except AttributeError:
+        return None
+    waiting = array('i', [0])
+    try:
+        fcntl.ioctl(fd, termios.FIONREAD, waiting, True)
+    except (IOError, OSError):
+        return None
+    return waiting[0]
+
+
+_baseline = None
+
+
+def start_tracemalloc(frames=1):
+    # Later reports can be compared against the snapshot taken here.
+    global _baseline
+    if tracemalloc is None:
+        raise ValueError('tracemalloc requires Python 3.4 or newer')
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    _baseline = tracemalloc.take_snapshot()
+
+
+def stop_tracemalloc():
+    global _baseline
+    if tracemalloc is not None and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _baseline = None
+
+
+def get_tracemalloc_report(limit=10, diff=False):
+    if tracemalloc is None or not tracemalloc.is_tracing():
+        return {
+            'available': tracemalloc is not None,
+            'tracing': False,
+        }
+
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+    ])
+    current, peak = tracemalloc.get_traced_memory()
+    if diff and _baseline is not None:
+        top = [
+            {
+                'location': str(stat.traceback),
+                'size_kb': stat.size / 1024.0,
+                'size_diff_kb': stat.size_diff / 1024.0,
+                'count': stat.count,
+                'count_diff': stat.count_diff,
+            }
+            for stat in snapshot.compare_to(_baseline, 'lineno')[:limit]
+        ]
+    else:
+        top = [
+            {
+                'location': str(stat.traceback),
+                'size_kb': stat.size / 1024.0,
+                'count': stat.count,
+            }
+            for stat in snapshot.statistics('lineno')[:limit]
+        ]
+    return {
+        'available': True,
+        'tracing': True,
+        'traced_kb': current / 1024.0,
+        'peak_kb': peak / 1024.0,
+        'top': top,
+    }
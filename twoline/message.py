@@ -0,0 +1,97 @@
+import datetime
+import hashlib
+import json
+
+import pytz
+
+
+def _normalize(value):
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(pytz.UTC)
+        return value.isoformat()
+    raise TypeError(value)
+
+
+class Message(object):
+    FIELDS = (
+        'id',
+        'message',
+        'expires',
+        'color',
+        'blink',
+        'backlight',
+        'interval',
+        'timeout',
+        'marquee',
+        'marquee_rate',
+        'tags',
+        'provider',
+        'priority',
+    )
+
+    # Messages only hold their own fields and a reference to the shared
+    # defaults; the two are merged the first time the message is shown and
+    # the result kept, so each tick hands out the very same dict.
+    __slots__ = FIELDS + ('defaults', '_resolved')
+
+    def __init__(self, **fields):
+        for field in self.FIELDS:
+            setattr(self, field, fields.pop(field, None))
+        if fields:
+            raise TypeError(
+                "Unexpected message fields: %s" % ', '.join(fields.keys())
+            )
+        self.defaults = None
+        self._resolved = None
+
+    @classmethod
+    def from_dict(cls, data, defaults=None):
+        message = cls(**dict((str(k), v) for k, v in data.items()))
+        if defaults is not None:
+            message.resolve(defaults)
+        return message
+
+    def to_dict(self):
+        data = {}
+        for field in self.FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                data[field] = value
+        return data
+
+    def digest(self):
+        # Identifies what the message says and how it is shown, regardless
+        # of its id, field order or how its values were spelled.
+        data = self.to_dict()
+        data.pop('id', None)
+        return hashlib.sha1(
+            json.dumps(data, sort_keys=True, default=_normalize)
+        ).hexdigest()
+
+    def resolve(self, defaults):
+        self.defaults = defaults
+        self._resolved = None
+        return self.resolved
+
+    @property
+    def resolved(self):
+        if self.defaults is None:
+            return None
+        if self._resolved is None:
+            self._resolved = self.defaults.copy()
+            self._resolved.update(self.to_dict())
+        return self._resolved
+
+    def __getstate__(self):
+        return self.to_dict(), self.defaults
+
+    def __setstate__(self, state):
+        data, defaults = state
+        for field in self.FIELDS:
+            setattr(self, field, data.get(field))
+        self.defaults = defaults
+        self._resolved = None
+
+    def __repr__(self):
+        return '<Message %s>' % self.id
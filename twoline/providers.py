@@ -0,0 +1,66 @@
+import os
+import socket
+import time
+
+
+PROVIDERS = {}
+
+VALUE_PLACEHOLDER = '{value}'
+
+
+class CachedProvider(object):
+    def __init__(self, fn, ttl):
+        self.fn = fn
+        self.ttl = ttl
+        self.value = None
+        self.expires_at = None
+
+    def __call__(self):
+        now = time.time()
+        if self.expires_at is None or now >= self.expires_at:
+            self.value = self.fn()
+            self.expires_at = now + self.ttl
+        return self.value
+
+
+def provider(name, ttl=1):
+    def decorator(fn):
+        PROVIDERS[name] = CachedProvider(fn, ttl)
+        return fn
+    return decorator
+
+
+def render(template, name):
+    value = PROVIDERS[name]()
+    if template is None:
+        return value
+    return template.replace(VALUE_PLACEHOLDER, value)
+
+
+@provider('clock', ttl=1)
+def clock():
+    return time.strftime('%H:%M:%S')
+
+
+@provider('date', ttl=60)
+def date():
+    return time.strftime('%Y-%m-%d')
+
+
+@provider('loadavg', ttl=5)
+def loadavg():
+    return '%.2f %.2f %.2f' % os.getloadavg()
+
+
+@provider('uptime', ttl=30)
+def uptime():
+    with open('/proc/uptime', 'r') as in_:
+        seconds = int(float(in_.read().split()[0]))
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    return '%dd %02d:%02d' % (days, hours, seconds // 60)
+
+
+@provider('hostname', ttl=3600)
+def hostname():
+    return socket.gethostname()
@@ -0,0 +1,321 @@
+import json
+import logging
+import multiprocessing
+from optparse import OptionParser
+import re
+import socket
+import sys
+import time
+
+from six.moves import http_client
+
+from twoline.capture import read_capture
+
+
+logger = logging.getLogger(__name__)
+
+
+VIRTUAL_DEVICE = '/dev/null'
+STARTUP_TIMEOUT = 10
+
+# Responses to these paths depend on the instance's own history rather
+# than on the requests replayed, so they are never compared.
+UNCOMPARED_PATHS = ('/', '/events/')
+# Ids the instance generates; those chosen by clients are replayed as
+# they are, so need no rewriting.
+GENERATED_ID = re.compile(r'[0-9a-f]{32}')
+
+
+def parse_speed(value):
+    if value == 'max':
+        return None
+    speed = float(value)
+    if speed <= 0:
+        raise ValueError('Speed must be positive or \'max\'')
+    return speed
+
+
+def get_free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def run_instance(port, options):
+    from twoline.manager import Manager
+    Manager(
+        VIRTUAL_DEVICE, ip='127.0.0.1', port=port, single_process=True,
+        **options
+    ).run()
+
+
+def start_instance(port, options):
+    process = multiprocessing.Process(
+        target=run_instance, args=(port, options), name='replay-target'
+    )
+    process.daemon = True
+    process.start()
+
+    deadline = time.time() + STARTUP_TIMEOUT
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return process
+        except socket.error:
+            time.sleep(0.05)
+    process.terminate()
+    raise RuntimeError('Instance did not start listening on port %s' % port)
+
+
+def load_json(data):
+    if data is None:
+        return None
+    try:
+        return json.loads(data)
+    except ValueError:
+        return None
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Replay(object):
+    def __init__(self, host, port, speed=1.0):
+        self.connection = http_client.HTTPConnection(host, port, timeout=30)
+        self.speed = speed
+        # Message ids are generated anew by the replayed instance; ids
+        # from the capture are rewritten to the replayed ones.
+        self.ids = {}
+        self.results = []
+        self.elapsed = 0
+
+    def translate(self, text):
+        return GENERATED_ID.sub(
+            lambda match: self.ids.get(match.group(0), match.group(0)), text
+        )
+
+    def request(self, record):
+        url = self.translate(record['path'])
+        if record.get('query'):
+            url += '?' + self.translate(record['query'])
+        headers = {}
+        if record.get('content_type'):
+            headers['Content-Type'] = record['content_type']
+        body = self.translate(record.get('body') or u'').encode('utf-8')
+
+        self.connection.request(
+            record['method'], url, body or None, headers
+        )
+        response = self.connection.getresponse()
+        return response.status, response.read().decode('utf-8', 'replace')
+
+    def learn_ids(self, captured, replayed):
+        if isinstance(captured, dict) and isinstance(replayed, dict):
+            if captured.get('id') and replayed.get('id'):
+                self.ids[captured['id']] = replayed['id']
+            # Messages created by a bulk load are only seen with their
+            # ids in listings; pair those not yet known in rotation order.
+            captured_list = captured.get('messages')
+            replayed_list = replayed.get('messages')
+            if (
+                isinstance(captured_list, list)
+                and isinstance(replayed_list, list)
+                and len(captured_list) == len(replayed_list)
+            ):
+                known = set(self.ids.values())
+                for old, new in zip(captured_list, replayed_list):
+                    old_id, new_id = old.get('id'), new.get('id')
+                    if (
+                        old_id and new_id and old_id not in self.ids
+                        and new_id not in known
+                    ):
+                        self.ids[old_id] = new_id
+
+    def compare(self, record, status, data):
+        if status != record['status']:
+            return 'status %s, captured %s' % (status, record['status'])
+        if record['method'] != 'GET' or record['path'] in UNCOMPARED_PATHS:
+            return None
+        if record['response'] is None:
+            return None
+        captured = load_json(self.translate(record['response']))
+        if captured != load_json(data):
+            return 'response differs from capture'
+        return None
+
+    def run(self, records):
+        if not records:
+            return
+        first = records[0]['time']
+        started = time.time()
+        for record in records:
+            if self.speed is not None:
+                delay = (
+                    started + (record['time'] - first) / self.speed
+                    - time.time()
+                )
+                if delay > 0:
+                    time.sleep(delay)
+
+            sent = time.time()
+            status, data = self.request(record)
+            latency = time.time() - sent
+            self.learn_ids(
+                load_json(record['response']), load_json(data)
+            )
+            self.results.append({
+                'method': record['method'],
+                'path': record['path'],
+                'latency': latency,
+                'divergence': self.compare(record, status, data),
+                'is_message_list': (
+                    record['method'] == 'GET'
+                    and record['path'] == '/message/'
+                    and record['response'] is not None
+                ),
+            })
+        self.elapsed = time.time() - started
+
+    def get_messages(self):
+        self.connection.request('GET', '/message/')
+        response = self.connection.getresponse()
+        return json.loads(response.read())['messages']
+
+
+def summarize(replay, records):
+    captured_span = records[-1]['time'] - records[0]['time']
+    latencies = [result['latency'] for result in replay.results]
+    divergent = [
+        result for result in replay.results if result['divergence']
+    ]
+    listings = [
+        result for result in replay.results if result['is_message_list']
+    ]
+    if listings:
+        final_state = listings[-1]['divergence'] or 'matches capture'
+    else:
+        final_state = (
+            'not compared; capture has no recorded GET /message/'
+        )
+
+    return {
+        'requests': len(replay.results),
+        'captured_seconds': captured_span,
+        'captured_rate': (
+            len(records) / captured_span if captured_span else None
+        ),
+        'replay_seconds': replay.elapsed,
+        'replay_rate': (
+            len(replay.results) / replay.elapsed if replay.elapsed else None
+        ),
+        'latency_p50_ms': percentile(latencies, 0.5) * 1000,
+        'latency_p99_ms': percentile(latencies, 0.99) * 1000,
+        'divergent_requests': len(divergent),
+        'divergences': [
+            '%s %s: %s' % (
+                result['method'], result['path'], result['divergence']
+            )
+            for result in divergent
+        ],
+        'final_message_state': final_state,
+        'final_message_count': len(replay.get_messages()),
+    }
+
+
+def print_summary(summary):
+    def rate(value):
+        return 'n/a' if value is None else '%.1f req/s' % value
+
+    print('Requests:            %s' % summary['requests'])
+    print('Captured:            %.2fs, %s' % (
+        summary['captured_seconds'], rate(summary['captured_rate'])
+    ))
+    print('Replayed:            %.2fs, %s' % (
+        summary['replay_seconds'], rate(summary['replay_rate'])
+    ))
+    print('Latency p50/p99:     %.2fms / %.2fms' % (
+        summary['latency_p50_ms'], summary['latency_p99_ms']
+    ))
+    print('Divergent requests:  %s' % summary['divergent_requests'])
+    for divergence in summary['divergences'][:10]:
+        print('    %s' % divergence)
+    print('Final message state: %s (%s messages)' % (
+        summary['final_message_state'], summary['final_message_count']
+    ))
+
+
+def main(args=None):
+    parser = OptionParser(usage='%prog replay [options] CAPTURE')
+    parser.add_option(
+        '--speed', '-s', dest='speed', default='1',
+        help='Playback speed relative to the capture (e.g. 1, 10) or max',
+    )
+    parser.add_option(
+        '--port', '-p', dest='port', default=None,
+        help='Port for the local instance; defaults to any free port',
+    )
+    parser.add_option(
+        '--loglevel', '-l', dest='loglevel', default='WARNING'
+    )
+    parser.add_option(
+        '--default-message-template',
+        dest='default_message_template',
+        default=None,
+        help='JSON file path or string',
+    )
+    parser.add_option(
+        '--default-flash-template',
+        dest='default_flash_template',
+        default=None,
+        help='JSON file path or string',
+    )
+    parser.add_option(
+        '--json', dest='json', default=None,
+        help='Also write the summary as JSON to this path',
+    )
+    options, args = parser.parse_args(args)
+
+    if len(args) != 1:
+        parser.error('Capture file required')
+    try:
+        speed = parse_speed(options.speed)
+    except ValueError as e:
+        parser.error(str(e))
+
+    logging.basicConfig(
+        level=logging.getLevelName(options.loglevel),
+        format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
+        datefmt='%H:%M:%S',
+    )
+
+    records = list(read_capture(args[0]))
+    if not records:
+        parser.error('Capture file contains no requests')
+
+    port = int(options.port) if options.port else get_free_port()
+    process = start_instance(port, {
+        'default_message_template': options.default_message_template,
+        'default_flash_template': options.default_flash_template,
+    })
+    try:
+        replay = Replay('127.0.0.1', port, speed)
+        replay.run(records)
+        summary = summarize(replay, records)
+    finally:
+        process.terminate()
+        process.join()
+
+    print_summary(summary)
+    if options.json:
+        with open(options.json, 'w') as out:
+            json.dump(summary, out, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -49,12 +49,42 @@ message_schema = {
             'type': 'integer',
             'minimum': 1,
         },
+        'marquee': {
+            'type': 'boolean',
+        },
+        'marquee_rate': {
+            # Characters per second; the LCD worker moves the marquee at
+            # most once per 0.1s tick, so it cannot scroll faster than 10.
+            'type': 'number',
+            'minimum': 0,
+            'exclusiveMinimum': True,
+            'maximum': 10,
+        },
+        'tags': {
+            'type': 'array',
+            'uniqueItems': True,
+            'items': {
+                'type': 'string',
+            }
+        },
+        'provider': {
+            # Name of a content provider; see twoline.providers
+            'type': 'string',
+        },
+        'priority': {
+            # Lower priority messages are evicted first when the message
+            # store is full and the 'priority' eviction policy is in use.
+            'type': 'integer',
+        },
         'id': {
             'type': 'string',
         }
     },
     'additionalProperties': False,
-    'required': ['message']
+    'anyOf': [
+        {'required': ['message']},
+        {'required': ['provider']},
+    ]
 }
 
 integer_schema = {
@@ -0,0 +1,106 @@
+import errno
+import logging
+import os
+import select
+import socket
+import stat
+
+from six.moves.BaseHTTPServer import HTTPServer
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler, make_server
+
+
+logger = logging.getLogger(__name__)
+
+
+# Requests arriving over a Unix socket come from this host; they are
+# given the loopback address so that, for instance, producer quotas
+# treat local clients alike whichever way they connect.
+UNIX_CLIENT_ADDRESS = ('127.0.0.1', 0)
+POLL_INTERVAL = 0.5
+
+
+def remove_stale_socket(path):
+    try:
+        mode = os.stat(path).st_mode
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return
+        raise
+    if not stat.S_ISSOCK(mode):
+        raise ValueError('%s exists and is not a socket' % path)
+    os.unlink(path)
+
+
+# Serves the WSGI application on a Unix domain socket, saving local
+# producers the cost of TCP.
+class UnixWSGIServer(BaseWSGIServer):
+    address_family = socket.AF_UNIX
+
+    def __init__(self, path, app, handler=None):
+        # ``BaseWSGIServer.__init__`` only knows how to bind TCP sockets.
+        remove_stale_socket(path)
+        HTTPServer.__init__(self, path, handler or WSGIRequestHandler)
+        self.path = path
+        self.app = app
+        self.passthrough_errors = False
+        self.shutdown_signal = False
+        self.ssl_context = None
+        self.host = path
+        self.port = None
+
+    def server_bind(self):
+        self.socket.bind(self.server_address)
+        # Stands in for (host, port) in each request's WSGI environment.
+        self.server_address = ('localhost', 0)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+    def get_request(self):
+        connection, _ = self.socket.accept()
+        return connection, UNIX_CLIENT_ADDRESS
+
+    def server_close(self):
+        BaseWSGIServer.server_close(self)
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def make_servers(app, ip=None, port=None, unix_socket=None):
+    servers = []
+    if port is not None:
+        servers.append(make_server(ip, int(port), app))
+    if unix_socket is not None:
+        servers.append(UnixWSGIServer(unix_socket, app))
+        logger.info('Listening on %s', unix_socket)
+    if not servers:
+        raise ValueError('Neither a TCP port nor a Unix socket was given')
+    return servers
+
+
+def handle_requests(servers, timeout=None):
+    # Handles at most one request on each server that has one waiting,
+    # waiting up to ``timeout`` seconds for one to arrive.
+    try:
+        ready, _, _ = select.select(servers, [], [], timeout)
+    except select.error as e:
+        if e.args[0] != errno.EINTR:
+            raise
+        return
+    for server in ready:
+        server._handle_request_noblock()
+
+
+def serve_forever(servers):
+    if len(servers) == 1:
+        servers[0].serve_forever()
+        return
+    try:
+        while True:
+            handle_requests(servers, POLL_INTERVAL)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            server.server_close()
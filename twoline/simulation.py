@@ -0,0 +1,194 @@
+import heapq
+import json
+import logging
+from optparse import OptionParser
+import random
+import sys
+import time
+
+from twoline.clock import SimulatedClock, timestamp
+
+
+VIRTUAL_DEVICE = '/dev/null'
+
+
+# Stands in for the LCD worker, noting each time the display state the
+# manager sends changes and for how long each message was shown.
+class DisplayRecorder(object):
+    def __init__(self, clock):
+        self.clock = clock
+        self.current = None
+        self.since = None
+        self.switches = 0
+        self.shown = {}
+
+    def send(self, frame):
+        cmd, args = frame
+        if cmd != 'message':
+            return
+        key = args[0].get('id') or args[0].get('message')
+        if key == self.current:
+            return
+        self.finish()
+        self.current = key
+        self.switches += 1
+
+    def finish(self):
+        now = self.clock.time()
+        if self.current is not None:
+            self.shown[self.current] = (
+                self.shown.get(self.current, 0) + now - self.since
+            )
+        self.since = now
+
+    def poll(self, timeout=0):
+        return False
+
+
+class Simulation(object):
+    def __init__(self, manager):
+        self.manager = manager
+        self.clock = manager.clock
+        self.recorder = DisplayRecorder(self.clock)
+        manager.lcd_pipe = self.recorder
+        self.ticks = 0
+        self.expirations = []
+
+    def get_next_deadline(self):
+        manager = self.manager
+        # Expiry times are kept in a heap; entries for messages that have
+        # since gone, or been replaced, are dropped as they surface.
+        while self.expirations:
+            expires, id_ = self.expirations[0]
+            message = manager.messages_by_id.get(id_)
+            if message is not None and message.expires == expires:
+                break
+            heapq.heappop(self.expirations)
+        deadlines = [
+            deadline for deadline in (manager.until, manager.flash_until)
+            if deadline is not None
+        ]
+        if self.expirations:
+            deadlines.append(self.expirations[0][0])
+        return timestamp(min(deadlines)) if deadlines else None
+
+    def run(self, duration):
+        # Between deadlines a manager tick changes nothing, so rather than
+        # running every tick the clock skips ahead to the first tick that
+        # falls after the next deadline.
+        sleep = self.manager.sleep
+        end = self.clock.time() + duration
+        self.expirations = [
+            (message.expires, message.id) for message in self.manager.messages
+            if message.expires is not None
+        ]
+        heapq.heapify(self.expirations)
+        self.manager.update_screen()
+        while self.clock.time() < end:
+            deadline = self.get_next_deadline()
+            now = self.clock.time()
+            if deadline is None or deadline >= end:
+                self.clock.advance(end - now)
+                break
+            ticks = max(1, int((deadline - now) / sleep) + 1)
+            self.clock.advance(ticks * sleep)
+            self.manager.update_screen()
+            self.ticks += 1
+        self.recorder.finish()
+
+
+def populate(manager, count, interval, expire_fraction, duration, seed):
+    rng = random.Random(seed)
+    defaults = manager.default_message.copy()
+    defaults['interval'] = interval
+    manager.default_message = defaults
+    for idx in range(count):
+        message = {
+            'message': 'Message %s' % idx,
+        }
+        if rng.random() < expire_fraction:
+            message['expires'] = rng.randint(1, int(duration))
+        manager.store_message(
+            manager.process_message(message, ignore_id=True)
+        )
+
+
+def simulate(
+    messages=1000, duration=86400, interval=5, expire_fraction=0.1,
+    seed=0
+):
+    from twoline.manager import Manager
+    manager = Manager(VIRTUAL_DEVICE, clock=SimulatedClock())
+    populate(manager, messages, interval, expire_fraction, duration, seed)
+    permanent = set(
+        message.id for message in manager.messages
+        if message.expires is None
+    )
+
+    simulation = Simulation(manager)
+    started = time.time()
+    simulation.run(duration)
+    elapsed = time.time() - started
+
+    shown = [
+        simulation.recorder.shown.get(id_, 0) for id_ in permanent
+    ]
+    return {
+        'simulated_seconds': duration,
+        'wall_seconds': elapsed,
+        'speedup': duration / elapsed if elapsed else None,
+        'ticks_run': simulation.ticks,
+        'ticks_simulated': int(duration / manager.sleep),
+        'switches': simulation.recorder.switches,
+        'messages': messages,
+        'expired': messages - len(manager.messages),
+        'never_shown': len([value for value in shown if not value]),
+        'min_shown_seconds': min(shown) if shown else None,
+        'max_shown_seconds': max(shown) if shown else None,
+    }
+
+
+def main(args=None):
+    parser = OptionParser(usage='%prog simulate [options]')
+    parser.add_option(
+        '--messages', '-m', dest='messages', default='1000',
+        help='Number of messages in rotation',
+    )
+    parser.add_option(
+        '--duration', '-d', dest='duration', default='86400',
+        help='Simulated seconds to run for',
+    )
+    parser.add_option(
+        '--interval', dest='interval', default='5',
+        help='Seconds each message is shown for',
+    )
+    parser.add_option(
+        '--expire-fraction', dest='expire_fraction', default='0.1',
+        help='Fraction of messages expiring at a random time',
+    )
+    parser.add_option(
+        '--seed', dest='seed', default='0',
+    )
+    parser.add_option(
+        '--json', dest='json', default=None,
+        help='Also write the results as JSON to this path',
+    )
+    options, args = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.WARNING)
+    results = simulate(
+        messages=int(options.messages),
+        duration=float(options.duration),
+        interval=float(options.interval),
+        expire_fraction=float(options.expire_fraction),
+        seed=int(options.seed),
+    )
+    for key in sorted(results):
+        print('%-20s %s' % (key, results[key]))
+    if options.json:
+        with open(options.json, 'w') as out:
+            json.dump(results, out, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,52 @@
+import logging
+import os
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+_started_at = None
+_reported = set()
+
+
+def get_process_start_time():
+    # Prefer the kernel's record of when this process started so that
+    # interpreter start-up and imports are included in the measurement.
+    try:
+        with open('/proc/self/stat', 'r') as in_:
+            # The command name may contain spaces; fields resume after it.
+            fields = in_.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime', 'r') as in_:
+            uptime = float(in_.read().split()[0])
+        ticks = os.sysconf(os.sysconf_names['SC_CLK_TCK'])
+        return time.time() - (uptime - float(fields[19]) / ticks)
+    except (IOError, OSError, IndexError, KeyError, ValueError):
+        return None
+
+
+def enable():
+    global _started_at
+    _started_at = get_process_start_time() or time.time()
+
+
+def is_enabled():
+    return _started_at is not None
+
+
+def mark(process_name, event):
+    if _started_at is None or (process_name, event) in _reported:
+        return
+    _reported.add((process_name, event))
+
+    now = time.time()
+    process_started_at = get_process_start_time() or _started_at
+    logger.info(
+        'Startup profile: %s process (pid %s) reached \'%s\' after %.3fs '
+        '(%.3fs since this process started)',
+        process_name,
+        os.getpid(),
+        event,
+        now - _started_at,
+        now - process_started_at,
+    )
@@ -0,0 +1,221 @@
+import datetime
+import unittest
+
+import pytz
+
+from twoline.admission import (
+    AdmissionControl, RateLimiter, EXPIRING, OLDEST, PRIORITY
+)
+from twoline.clock import SimulatedClock
+from twoline.exceptions import QuotaExceeded
+from twoline.message import Message
+
+
+def make_message(id_, text='abc', **fields):
+    return Message(id=id_, message=text, **fields)
+
+
+def get_state(admission):
+    return (
+        dict(admission.entries),
+        admission.total_bytes,
+        dict(admission.producer_counts),
+        sorted(admission.heap),
+        dict(
+            (producer, sorted(heap))
+            for producer, heap in admission.producer_heaps.items()
+        ),
+    )
+
+
+class AdmissionControlTest(unittest.TestCase):
+    def fill(self, admission, count, producer='p'):
+        for idx in range(count):
+            admission.add(make_message('m%s' % idx), producer)
+
+    def test_disabled_admits_everything(self):
+        admission = AdmissionControl()
+        self.fill(admission, 5)
+        self.assertEqual(admission.admit(make_message('x')), [])
+        self.assertEqual(admission.entries, {})
+
+    def test_reject(self):
+        admission = AdmissionControl(max_messages=2)
+        self.fill(admission, 2)
+        self.assertRaises(
+            QuotaExceeded, admission.admit, make_message('x'), 'p'
+        )
+        # Replacing a stored message does not add to the count.
+        self.assertEqual(admission.admit(make_message('m0'), 'p'), [])
+
+    def test_message_larger_than_store(self):
+        admission = AdmissionControl(max_bytes=5, policy=OLDEST)
+        self.assertRaises(
+            QuotaExceeded, admission.admit, make_message('x', 'abcdef')
+        )
+
+    def test_oldest(self):
+        admission = AdmissionControl(max_messages=3, policy=OLDEST)
+        self.fill(admission, 3)
+        self.assertEqual(admission.admit(make_message('x'), 'p'), ['m0'])
+
+    def test_oldest_by_bytes(self):
+        admission = AdmissionControl(max_bytes=9, policy=OLDEST)
+        self.fill(admission, 3)
+        self.assertEqual(
+            admission.admit(make_message('x', 'abcdef'), 'p'), ['m0', 'm1']
+        )
+
+    def test_replaced_message_is_not_evicted(self):
+        admission = AdmissionControl(max_bytes=9, policy=OLDEST)
+        self.fill(admission, 3)
+        self.assertEqual(
+            admission.admit(make_message('m0', 'abcdef'), 'p'), ['m1']
+        )
+
+    def test_expiring(self):
+        admission = AdmissionControl(max_messages=3, policy=EXPIRING)
+        now = datetime.datetime(2020, 1, 1, tzinfo=pytz.UTC)
+        admission.add(make_message('never'), 'p')
+        admission.add(make_message(
+            'later', expires=now + datetime.timedelta(hours=2)
+        ), 'p')
+        admission.add(make_message(
+            'soon', expires=now + datetime.timedelta(hours=1)
+        ), 'p')
+        self.assertEqual(admission.admit(make_message('x'), 'p'), ['soon'])
+        admission.remove('soon')
+        admission.add(make_message('x'), 'p')
+        self.assertEqual(admission.admit(make_message('y'), 'p'), ['later'])
+        admission.remove('later')
+        admission.add(make_message('y'), 'p')
+        # Then those that never expire, oldest first.
+        self.assertEqual(admission.admit(make_message('z'), 'p'), ['never'])
+
+    def test_priority(self):
+        admission = AdmissionControl(max_messages=2, policy=PRIORITY)
+        admission.add(make_message('high', priority=5), 'p')
+        admission.add(make_message('low', priority=1), 'p')
+        self.assertEqual(
+            admission.admit(make_message('x', priority=3), 'p'), ['low']
+        )
+        admission.remove('low')
+        admission.add(make_message('x', priority=3), 'p')
+        self.assertRaises(
+            QuotaExceeded,
+            admission.admit, make_message('y', priority=1), 'p'
+        )
+
+    def test_producer_only_evicts_its_own(self):
+        admission = AdmissionControl(max_per_producer=2, policy=OLDEST)
+        admission.add(make_message('a0'), 'a')
+        admission.add(make_message('b0'), 'b')
+        admission.add(make_message('b1'), 'b')
+        admission.add(make_message('a1'), 'a')
+        self.assertEqual(admission.admit(make_message('b2'), 'b'), ['b0'])
+        self.assertEqual(admission.admit(make_message('a2'), 'a'), ['a0'])
+
+    def test_reject_per_producer(self):
+        admission = AdmissionControl(max_per_producer=1)
+        admission.add(make_message('a0'), 'a')
+        self.assertEqual(admission.admit(make_message('b0'), 'b'), [])
+        self.assertRaises(
+            QuotaExceeded, admission.admit, make_message('a1'), 'a'
+        )
+
+    def test_admit_does_not_change_state(self):
+        admission = AdmissionControl(max_messages=3, policy=OLDEST)
+        self.fill(admission, 3)
+        state = get_state(admission)
+        self.assertEqual(admission.admit(make_message('x'), 'p'), ['m0'])
+        self.assertEqual(get_state(admission), state)
+
+    def test_failed_admission_does_not_change_state(self):
+        admission = AdmissionControl(
+            max_messages=3, max_bytes=10, policy=OLDEST
+        )
+        self.fill(admission, 3)
+        state = get_state(admission)
+        self.assertRaises(
+            QuotaExceeded,
+            admission.admit_all,
+            [make_message('x', 'a' * 10), make_message('y', 'a' * 11)], 'p'
+        )
+        self.assertEqual(get_state(admission), state)
+
+    def test_admit_all(self):
+        admission = AdmissionControl(max_messages=3, policy=OLDEST)
+        self.fill(admission, 3)
+        self.assertEqual(
+            admission.admit_all([make_message('x'), make_message('y')], 'p'),
+            ['m0', 'm1']
+        )
+
+    def test_admit_all_does_not_evict_the_batch(self):
+        admission = AdmissionControl(max_bytes=9, policy=OLDEST)
+        self.fill(admission, 3)
+        self.assertRaises(
+            QuotaExceeded,
+            admission.admit_all,
+            [make_message('m0', 'abcde'), make_message('m1', 'abcde')], 'p'
+        )
+
+    def test_remove(self):
+        admission = AdmissionControl(max_messages=10, policy=OLDEST)
+        self.fill(admission, 2)
+        admission.remove('m0')
+        admission.remove('missing')
+        self.assertEqual(list(admission.entries), ['m1'])
+        self.assertEqual(admission.total_bytes, 3)
+        self.assertEqual(dict(admission.producer_counts), {'p': 1})
+
+    def test_stale_entries_are_skipped_and_compacted(self):
+        admission = AdmissionControl(max_messages=2, policy=OLDEST)
+        for _ in range(200):
+            admission.add(make_message('m0'), 'p')
+        admission.add(make_message('m1'), 'p')
+        self.assertTrue(len(admission.heap) <= 2 * 2 + 64 + 1)
+        self.assertEqual(admission.admit(make_message('x'), 'p'), ['m0'])
+
+
+class RateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = SimulatedClock(0)
+
+    def test_burst_then_refill(self):
+        limiter = RateLimiter(60, burst=2, clock=self.clock)
+        limiter.check('a')
+        limiter.check('a')
+        self.assertRaises(QuotaExceeded, limiter.check, 'a')
+        # Other sources have buckets of their own.
+        limiter.check('b')
+        # 60 per minute is one more each second.
+        self.clock.advance(1)
+        limiter.check('a')
+        self.assertRaises(QuotaExceeded, limiter.check, 'a')
+
+    def test_burst_defaults_to_rate(self):
+        limiter = RateLimiter(3, clock=self.clock)
+        for _ in range(3):
+            limiter.check('a')
+        self.assertRaises(QuotaExceeded, limiter.check, 'a')
+
+    def test_bucket_does_not_overfill(self):
+        limiter = RateLimiter(60, burst=2, clock=self.clock)
+        self.clock.advance(3600)
+        limiter.check('a')
+        limiter.check('a')
+        self.assertRaises(QuotaExceeded, limiter.check, 'a')
+
+    def test_full_buckets_are_forgotten(self):
+        limiter = RateLimiter(60, burst=1, clock=self.clock)
+        limiter.MAX_SOURCES = 4
+        for source in range(4):
+            limiter.check(source)
+        self.clock.advance(10)
+        limiter.check('new')
+        self.assertEqual(list(limiter.buckets), ['new'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import time
+import unittest
+
+from twoline.client import Client
+from twoline.fleet import Fleet
+
+
+class SlowClient(object):
+    def __init__(self, target, delay):
+        self.target = target
+        self.delay = delay
+        self.closed = False
+
+    def __str__(self):
+        return self.target
+
+    def request(self, method, path, data=None):
+        time.sleep(self.delay)
+        return 200, {'ok': True}
+
+    def close(self):
+        self.closed = True
+
+
+class FleetTest(unittest.TestCase):
+    def make_fleet(self, delays, **kwargs):
+        fleet = Fleet(sorted(delays), **kwargs)
+        for target, delay in delays.items():
+            fleet.clients[target] = SlowClient(target, delay)
+        self.addCleanup(fleet.close)
+        return fleet
+
+    def test_timeout_counts_from_when_each_request_starts(self):
+        # One worker: the second request only starts once the first is
+        # done, after more than half of the timeout.
+        fleet = self.make_fleet(
+            {'a': 0.15, 'b': 0.15}, timeout=0.25, workers=1
+        )
+        results = fleet.request('GET', '/message/')
+        self.assertEqual([result['error'] for result in results], [
+            None, None
+        ])
+
+    def test_timed_out_client_is_replaced(self):
+        fleet = self.make_fleet({'a': 0, 'b': 0.5}, timeout=0.1)
+        slow = fleet.clients['b']
+        results = fleet.request('GET', '/message/')
+        self.assertEqual(results[0]['error'], None)
+        self.assertEqual(results[1]['error'], 'No response within 0.1s')
+        self.assertTrue(slow.closed)
+        self.assertTrue(isinstance(fleet.clients['b'], Client))
+
+
+if __name__ == '__main__':
+    unittest.main()
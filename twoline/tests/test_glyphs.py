@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from twoline.glyphs import (
+    FALLBACK_CHARACTER, GlyphCache, ROM_CHARACTERS, get_glyph
+)
+
+
+# Accented letters that have glyphs but are not in the character ROM.
+CUSTOM = u'éèêëìíîï'
+
+
+class GlyphCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = GlyphCache(slots=3)
+
+    def test_ascii_and_rom_characters_need_no_slot(self):
+        encoded, uploads = self.cache.encode(u'a°ñ')
+        self.assertEqual(
+            encoded, 'a' + ROM_CHARACTERS[u'°'] + ROM_CHARACTERS[u'ñ']
+        )
+        self.assertEqual(uploads, [])
+
+    def test_control_characters_become_spaces(self):
+        self.assertEqual(self.cache.encode(u'a\tb')[0], 'a b')
+
+    def test_uploads_each_glyph_once(self):
+        encoded, uploads = self.cache.encode(u'éé')
+        self.assertEqual(encoded, '\x00\x00')
+        self.assertEqual(uploads, [(0, get_glyph(u'é'))])
+        self.assertEqual(self.cache.encode(u'é'), ('\x00', []))
+
+    def test_bytes_are_decoded(self):
+        self.assertEqual(self.cache.encode(u'é'.encode('utf-8'))[0], '\x00')
+
+    def test_evicts_least_recently_used(self):
+        self.cache.encode(CUSTOM[:3])
+        # Using the first glyph again makes the second the oldest.
+        self.cache.encode(CUSTOM[0])
+        encoded, uploads = self.cache.encode(CUSTOM[3])
+        self.assertEqual(uploads, [(1, get_glyph(CUSTOM[3]))])
+        self.assertEqual(encoded, '\x01')
+        self.assertEqual(
+            list(self.cache.slots), [CUSTOM[2], CUSTOM[0], CUSTOM[3]]
+        )
+
+    def test_keep_is_not_evicted(self):
+        self.cache.encode(CUSTOM[:3])
+        encoded, uploads = self.cache.encode(CUSTOM[3], keep=CUSTOM[:2])
+        self.assertEqual(uploads, [(2, get_glyph(CUSTOM[3]))])
+        self.assertTrue(CUSTOM[0] in self.cache.slots)
+        self.assertTrue(CUSTOM[1] in self.cache.slots)
+
+    def test_text_does_not_evict_its_own_glyphs(self):
+        encoded, uploads = self.cache.encode(CUSTOM[:4])
+        self.assertEqual(len(uploads), 3)
+        self.assertEqual(encoded, '\x00\x01\x02e')
+
+    def test_falls_back_when_every_slot_is_kept(self):
+        self.cache.encode(CUSTOM[:3])
+        encoded, uploads = self.cache.encode(u'ì', keep=CUSTOM[:3])
+        self.assertEqual(uploads, [])
+        self.assertEqual(encoded, 'i')
+
+    def test_unknown_characters_fall_back(self):
+        self.assertEqual(self.cache.encode(u'☃')[0], FALLBACK_CHARACTER)
+
+    def test_reset(self):
+        self.cache.encode(CUSTOM[:3])
+        self.cache.reset()
+        self.assertEqual(self.cache.encode(CUSTOM[2])[1][0][0], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import unittest
+
+from twoline import ipc
+from twoline.ipc import CoalescingChannel, decode, encode
+
+
+MESSAGE = {
+    'backlight': True,
+    'color': (255, 0, 0),
+    'marquee': True,
+    'marquee_rate': 4.0,
+    'blink': [(255, 0, 0), (0, 0, 0)],
+    'message': u'Hello \xe9',
+}
+
+
+class RecordingChannel(object):
+    def __init__(self):
+        self.sent = []
+
+    def send(self, frame):
+        self.sent.append(frame)
+
+
+def round_trip(frame):
+    return decode(encode(frame))
+
+
+class EncodeDecodeTest(unittest.TestCase):
+    def test_message(self):
+        self.assertEqual(
+            round_trip(('message', [MESSAGE])), ('message', [MESSAGE])
+        )
+
+    def test_message_defaults(self):
+        cmd, args = round_trip(('message', [{'message': u'Hi'}]))
+        self.assertEqual(cmd, 'message')
+        self.assertEqual(args, [{'backlight': True, 'message': u'Hi'}])
+
+    def test_prefetch(self):
+        self.assertEqual(
+            round_trip(('prefetch', [MESSAGE, 1234.5])),
+            ('prefetch', [MESSAGE, 1234.5])
+        )
+        self.assertEqual(
+            round_trip(('prefetch', [None, None])),
+            ('prefetch', [None, None])
+        )
+
+    def test_integer(self):
+        self.assertEqual(
+            round_trip(('set_brightness', [200])), ('set_brightness', [200])
+        )
+
+    def test_text(self):
+        frame = ('put_message_by_id', [u'abc', u'{"message": "x"}', u'p'])
+        self.assertEqual(round_trip(frame), frame)
+
+    def test_unknown_command_is_pickled(self):
+        frame = ('report_memory', [3])
+        data = encode(frame)
+        self.assertEqual(data[0], chr(ipc.GENERIC))
+        self.assertEqual(decode(data), frame)
+
+    def test_unrepresentable_arguments_are_pickled(self):
+        frame = ('set_brightness', ['high'])
+        data = encode(frame)
+        self.assertEqual(data[0], chr(ipc.GENERIC))
+        self.assertEqual(decode(data), frame)
+
+    def test_batch(self):
+        frames = [
+            ['message', [MESSAGE]],
+            ['set_contrast', [10]],
+            ['report_events', [1, None]],
+        ]
+        self.assertEqual(
+            round_trip(('batch', [7, frames])), ('batch', [7, frames])
+        )
+
+    def test_traced_batch(self):
+        frames = [['set_brightness', [5]]]
+        frame = ('traced', ['abc123', 1.5, 'batch', [2, frames]])
+        self.assertEqual(round_trip(frame), frame)
+
+
+class CoalescingChannelTest(unittest.TestCase):
+    def setUp(self):
+        self.channel = RecordingChannel()
+        self.coalescing = CoalescingChannel(self.channel)
+
+    def sent_batches(self):
+        return [args for cmd, args in self.channel.sent]
+
+    def test_sends_while_window_is_open(self):
+        self.coalescing.send(('set_brightness', [1]))
+        self.assertEqual(
+            self.sent_batches(), [[1, [['set_brightness', [1]]]]]
+        )
+        self.assertEqual(list(self.coalescing.unacknowledged), [1])
+
+    def test_holds_and_coalesces_until_acknowledged(self):
+        self.coalescing.send(('set_brightness', [1]))
+        self.coalescing.send(('set_brightness', [2]))
+        self.coalescing.send(('set_contrast', [3]))
+        self.coalescing.send(('set_brightness', [4]))
+        self.assertEqual(len(self.channel.sent), 1)
+
+        self.coalescing.acknowledge(1)
+        self.assertEqual(self.sent_batches()[1], [2, [
+            ['set_contrast', [3]],
+            ['set_brightness', [4]],
+        ]])
+        self.assertEqual(list(self.coalescing.unacknowledged), [2])
+
+    def test_unchanged_state_is_not_resent(self):
+        self.coalescing.send(('message', [MESSAGE]))
+        self.coalescing.acknowledge(1)
+        self.coalescing.send(('message', [MESSAGE]))
+        self.assertEqual(len(self.channel.sent), 1)
+
+    def test_acknowledge_covers_earlier_batches(self):
+        self.coalescing.window = 2
+        self.coalescing.send(('set_brightness', [1]))
+        self.coalescing.send(('set_contrast', [2]))
+        self.coalescing.acknowledge(2)
+        self.assertEqual(len(self.coalescing.unacknowledged), 0)
+
+    def test_requeues_control_commands_after_timeout(self):
+        self.coalescing.ack_timeout = 0
+        self.coalescing.send(('message', [MESSAGE]))
+        self.coalescing.acknowledge(1)
+        self.coalescing.send(('set_brightness', [1]))
+        self.coalescing.send(('message', [{'message': u'next'}]))
+        self.coalescing.send(('set_contrast', [2]))
+
+        # The brightness change was never acknowledged, so it goes out
+        # again; the display state is left for the manager's next tick.
+        sequence, frames = self.sent_batches()[-1]
+        self.assertEqual(sequence, 4)
+        self.assertEqual(
+            sorted(cmd for cmd, args in frames),
+            ['set_brightness', 'set_contrast']
+        )
+        self.assertEqual(self.coalescing.last_state, {})
+
+    def test_waits_for_acknowledgement_before_timeout(self):
+        self.coalescing.ack_timeout = 60
+        self.coalescing.send(('set_brightness', [1]))
+        self.coalescing.send(('set_contrast', [2]))
+        self.assertEqual(len(self.channel.sent), 1)
+        self.assertEqual(list(self.coalescing.pending), ['set_contrast'])
+
+
+if __name__ == '__main__':
+    unittest.main()
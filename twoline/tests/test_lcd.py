@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from twoline.clock import SimulatedClock
+from twoline.glyphs import GlyphCache
+from twoline.lcd import LcdManager
+
+
+class RecordingPipe(object):
+    def __init__(self):
+        self.sent = []
+
+    def send(self, frame):
+        self.sent.append(frame)
+
+    def poll(self, timeout=0):
+        return False
+
+
+def make_lcd(slots=None):
+    lcd = LcdManager(
+        '/dev/null', pipe=RecordingPipe(), clock=SimulatedClock(0)
+    )
+    if slots is not None:
+        lcd.client.glyphs = GlyphCache(slots)
+    lcd.written = []
+
+    def write(data):
+        lcd.written.append(data)
+        return True
+    lcd.client.write = write
+    return lcd
+
+
+class PrefetchTest(unittest.TestCase):
+    def setUp(self):
+        self.lcd = make_lcd()
+        self.lcd.dispatch('message', [{'message': u'first'}])
+        self.lcd.written = []
+
+    def test_switches_on_deadline(self):
+        self.lcd.prefetch({'message': u'second'}, 10)
+        self.lcd.clock.advance(9)
+        self.lcd.switch_if_due()
+        self.assertEqual(self.lcd.message, u'first')
+
+        self.lcd.clock.advance(1)
+        self.lcd.switch_if_due()
+        self.assertEqual(self.lcd.message, u'second')
+        self.assertEqual(self.lcd.next_message, None)
+        self.assertIn('second'.ljust(32), self.lcd.written[-1])
+
+    def test_switch_without_prefetched_write_redraws(self):
+        self.lcd.prefetch({'message': u'second', 'blink': [[1, 2, 3]]}, 10)
+        self.assertEqual(self.lcd.next_write, None)
+        self.lcd.clock.advance(10)
+        self.lcd.switch_if_due()
+        self.assertEqual(self.lcd.message, u'second')
+        self.assertEqual(self.lcd.blink, [[1, 2, 3]])
+
+    def test_cleared_prefetch_does_not_switch(self):
+        self.lcd.prefetch({'message': u'second'}, 10)
+        self.lcd.prefetch(None, None)
+        self.lcd.clock.advance(10)
+        self.lcd.switch_if_due()
+        self.assertEqual(self.lcd.message, u'first')
+
+    def test_prefetched_glyphs_survive_page_cycling(self):
+        lcd = make_lcd(slots=4)
+        lcd.dispatch('message', [{'message': u'éè'.ljust(32) + u'áà'}])
+        lcd.prefetch({'message': u'óò next'}, 10)
+        slots = dict(lcd.client.glyphs.slots)
+
+        # Cycling through the current message's pages needs more glyphs
+        # than are free; the prefetched ones must not be given up.
+        lcd.handle_text_cycle()
+        lcd.handle_text_cycle()
+        self.assertEqual(lcd.client.glyphs.slots[u'ó'], slots[u'ó'])
+        self.assertEqual(lcd.client.glyphs.slots[u'ò'], slots[u'ò'])
+
+        lcd.clock.advance(10)
+        lcd.switch_if_due()
+        self.assertIn(
+            chr(slots[u'ó']) + chr(slots[u'ò']) + ' next', lcd.written[-1]
+        )
+
+
+class MarqueeTest(unittest.TestCase):
+    def setUp(self):
+        self.lcd = make_lcd()
+        self.max_gap = len(
+            self.lcd.client.COMMANDS['set_cursor_position'](1, 1)
+        )
+
+    def apply(self, frame, regions):
+        rows = [list(line) for line in frame]
+        for col, row, text in regions:
+            rows[row][col:col + len(text)] = list(text)
+        return [''.join(row) for row in rows]
+
+    def test_unchanged_frame(self):
+        frame = ['abcdefghijklmnop', 'qrstuvwxyz012345']
+        self.assertEqual(self.lcd.get_frame_diff(frame, frame), [])
+
+    def test_changed_characters(self):
+        before = ['a' * 16, 'b' * 16]
+        after = ['a' * 3 + 'X' + 'a' * 12, 'b' * 15 + 'Y']
+        self.assertEqual(
+            self.lcd.get_frame_diff(before, after),
+            [(3, 0, 'X'), (15, 1, 'Y')]
+        )
+
+    def test_short_gaps_are_rewritten(self):
+        before = ['a' * 16]
+        after = ['X' + 'a' * self.max_gap + 'X' + 'a' * 10]
+        self.assertEqual(
+            self.lcd.get_frame_diff(before, after)[0][2],
+            after[0][:self.max_gap + 2]
+        )
+
+    def test_long_gaps_are_skipped(self):
+        before = ['a' * 16]
+        after = ['X' + 'a' * (self.max_gap + 1) + 'X' + 'a' * 9]
+        self.assertEqual(
+            self.lcd.get_frame_diff(before, after),
+            [(0, 0, 'X'), (self.max_gap + 2, 0, 'X')]
+        )
+
+    def test_steps_turn_each_frame_into_the_next(self):
+        self.lcd.message = u'A message much wider than the display'
+        self.lcd.set_marquee(2)
+        frames = self.lcd.marquee_frames
+        self.assertEqual(len(self.lcd.marquee_steps), len(frames))
+        for idx, step in enumerate(self.lcd.marquee_steps):
+            self.assertEqual(
+                self.apply(frames[idx], step),
+                frames[(idx + 1) % len(frames)]
+            )
+
+    def test_message_that_fits_is_not_rewritten(self):
+        self.lcd.message = u'Short'
+        self.lcd.set_marquee(2)
+        self.lcd.written = []
+        for step in self.lcd.marquee_steps:
+            self.lcd.handle_marquee()
+        self.assertEqual(self.lcd.written, [])
+
+    def test_step_interval(self):
+        self.lcd.message = u'A message much wider than the display'
+        self.lcd.set_marquee(2)
+        self.assertEqual(self.lcd.marquee_interval, 4)
+        self.lcd.set_marquee(10)
+        self.assertEqual(self.lcd.marquee_interval, 0)
+        self.lcd.set_marquee(20)
+        self.assertEqual(self.lcd.marquee_interval, 0)
+
+    def test_handle_marquee_writes_only_the_step(self):
+        self.lcd.message = u'A message much wider than the display'
+        self.lcd.set_marquee(2)
+        self.lcd.written = []
+        self.lcd.handle_marquee()
+        self.assertEqual(self.lcd.marquee_idx, 1)
+        written = self.lcd.written[-1]
+        for col, row, text in self.lcd.marquee_steps[0]:
+            self.assertIn(str(text), written)
+        self.assertTrue(len(written) < 32)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+import json
+import unittest
+
+from twoline.clock import SimulatedClock
+from twoline.manager import Manager
+
+
+class RecordingPipe(object):
+    def __init__(self):
+        self.sent = []
+
+    def send(self, frame):
+        self.sent.append(frame)
+
+    def poll(self, timeout=0):
+        return False
+
+
+def make_manager(**kwargs):
+    manager = Manager('/dev/null', clock=SimulatedClock(0), **kwargs)
+    manager.web_pipe = RecordingPipe()
+    manager.lcd_pipe = RecordingPipe()
+    return manager
+
+
+def call(manager, command, *args):
+    # Runs a web command and returns what it sent back to the web process.
+    getattr(manager, command)(*args)
+    return manager.web_pipe.sent.pop()
+
+
+class DeleteTest(unittest.TestCase):
+    def setUp(self):
+        self.manager = make_manager()
+        for id_, tags in (
+            ('a', ['odd']),
+            ('b', ['even']),
+            ('c', ['odd']),
+            ('d', ['even', 'last']),
+            ('e', ['odd']),
+        ):
+            self.manager.admit_message(self.manager.process_message(
+                {'id': id_, 'message': id_, 'tags': tags}
+            ))
+
+    def ids(self):
+        return [message.id for message in self.manager.messages]
+
+    def test_keeps_order_and_positions(self):
+        self.manager.delete_messages(['d', 'b'])
+        self.assertEqual(self.ids(), ['a', 'c', 'e'])
+        self.assertEqual(
+            self.manager.message_positions, {'a': 0, 'c': 1, 'e': 2}
+        )
+        self.assertNotIn('b', self.manager.messages_by_id)
+
+    def test_cleans_up_the_tag_index(self):
+        self.manager.delete_messages(['d'])
+        self.assertNotIn('last', self.manager.tag_index)
+        self.assertEqual(self.manager.tag_index['even'], set(['b']))
+
+    def test_current_message_moves_to_the_next_kept_one(self):
+        self.manager.message_id = 'b'
+        self.manager.delete_messages(['b', 'c'])
+        self.assertEqual(self.manager.message_id, 'd')
+
+    def test_current_message_wraps_around(self):
+        self.manager.message_id = 'd'
+        self.manager.delete_messages(['d', 'e'])
+        self.assertEqual(self.manager.message_id, 'a')
+
+    def test_deleting_everything(self):
+        self.manager.message_id = 'a'
+        self.manager.delete_messages(self.ids())
+        self.assertEqual(self.manager.messages, [])
+        self.assertEqual(self.manager.message_id, None)
+        self.assertEqual(self.manager.tag_index, {})
+
+    def test_delete_by_tag(self):
+        self.assertEqual(
+            call(self.manager, 'delete_messages_by_tag', 'odd'),
+            ('response', [3])
+        )
+        self.assertEqual(self.ids(), ['b', 'd'])
+        self.assertEqual(
+            call(self.manager, 'delete_messages_by_tag', 'odd')[0], 'error'
+        )
+
+
+class FlashTest(unittest.TestCase):
+    def setUp(self):
+        self.manager = make_manager(flash_interval=1, flash_queue_size=2)
+
+    def put_flash(self, text, producer='p'):
+        return call(
+            self.manager, 'put_flash', json.dumps({'message': text}), producer
+        )
+
+    def queued(self):
+        return [
+            (producer, flash.message)
+            for producer, flash in self.manager.flash_queue.items()
+        ]
+
+    def test_first_flash_is_shown(self):
+        self.assertEqual(self.put_flash('one'), (
+            'response', [self.manager.flash.resolved, False]
+        ))
+        self.assertEqual(self.manager.flash.message, 'one')
+        self.assertEqual(self.queued(), [])
+
+    def test_later_flashes_are_queued(self):
+        self.put_flash('one', 'a')
+        self.put_flash('two', 'b')
+        self.assertEqual(self.manager.flash.message, 'one')
+        self.assertEqual(self.queued(), [('b', 'two')])
+
+    def test_newer_flash_replaces_the_producers_queued_one(self):
+        self.put_flash('one', 'a')
+        self.put_flash('two', 'b')
+        self.put_flash('three', 'c')
+        self.put_flash('four', 'b')
+        self.assertEqual(self.queued(), [('c', 'three'), ('b', 'four')])
+
+    def test_duplicates_are_not_queued(self):
+        self.put_flash('one', 'a')
+        self.put_flash('two', 'b')
+        self.assertTrue(self.put_flash('one', 'c')[1][1])
+        self.assertTrue(self.put_flash('two', 'c')[1][1])
+        self.assertEqual(self.queued(), [('b', 'two')])
+
+    def test_full_queue_drops_the_oldest(self):
+        self.put_flash('one', 'a')
+        for producer in 'bcd':
+            self.put_flash(producer, producer)
+        self.assertEqual(self.queued(), [('c', 'c'), ('d', 'd')])
+
+    def test_flash_is_cut_short_when_others_wait(self):
+        self.put_flash('one', 'a')
+        self.manager.get_current_message()
+        self.put_flash('two', 'b')
+        self.manager.clock.advance(0.5)
+        self.manager.get_current_message()
+        self.assertEqual(self.manager.flash.message, 'one')
+        self.manager.clock.advance(0.5)
+        self.manager.get_current_message()
+        self.assertEqual(self.manager.flash.message, 'two')
+        self.assertEqual(self.queued(), [])
+
+    def test_flash_stays_for_its_timeout_when_alone(self):
+        self.put_flash('one', 'a')
+        self.manager.get_current_message()
+        self.manager.clock.advance(5)
+        self.manager.get_current_message()
+        self.assertEqual(self.manager.flash.message, 'one')
+        self.manager.clock.advance(6)
+        self.manager.handle_expirations()
+        self.assertEqual(self.manager.flash, None)
+
+    def test_rate_limit(self):
+        manager = make_manager(flash_rate=1)
+        call(manager, 'put_flash', '{"message": "one"}', 'a')
+        response = call(manager, 'put_flash', '{"message": "two"}', 'a')
+        self.assertEqual(response[0], 'error')
+        self.assertEqual(type(response[1][0]).__name__, 'QuotaExceeded')
+
+    def test_delete_clears_the_queue(self):
+        self.put_flash('one', 'a')
+        self.put_flash('two', 'b')
+        call(self.manager, 'delete_flash')
+        self.assertEqual(self.manager.flash, None)
+        self.assertEqual(self.queued(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
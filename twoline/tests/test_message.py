@@ -0,0 +1,38 @@
+import pickle
+import unittest
+
+from twoline.message import Message
+
+
+class ResolvedTest(unittest.TestCase):
+    def setUp(self):
+        self.message = Message.from_dict(
+            {'id': 'a', 'message': u'Hi'}, {'interval': 5, 'message': u''}
+        )
+
+    def test_merges_defaults(self):
+        self.assertEqual(
+            self.message.resolved,
+            {'id': 'a', 'message': u'Hi', 'interval': 5}
+        )
+
+    def test_is_kept_between_accesses(self):
+        self.assertIs(self.message.resolved, self.message.resolved)
+
+    def test_new_defaults_replace_it(self):
+        before = self.message.resolved
+        self.message.resolve({'interval': 10})
+        self.assertIsNot(self.message.resolved, before)
+        self.assertEqual(self.message.resolved['interval'], 10)
+
+    def test_unresolved(self):
+        self.assertIs(Message(message=u'Hi').resolved, None)
+
+    def test_pickle(self):
+        self.message.resolved
+        copied = pickle.loads(pickle.dumps(self.message, 2))
+        self.assertEqual(copied.resolved, self.message.resolved)
+
+
+if __name__ == '__main__':
+    unittest.main()
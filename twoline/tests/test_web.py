@@ -0,0 +1,104 @@
+import json
+import unittest
+from io import BytesIO
+
+from twoline.loop import local_pipe
+from twoline.tests.test_manager import make_manager
+from twoline.web import NOOP_HEADER, app
+
+
+class WebTestCase(unittest.TestCase):
+    def setUp(self):
+        self.manager = make_manager()
+        self.manager.web_pipe, web_pipe = local_pipe()
+        web_pipe.on_wait = self.manager.handle_web_pipe
+        app.config['PIPE'] = web_pipe
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config.pop('PIPE', None)
+
+
+class BulkTest(WebTestCase):
+    def test_loads_lines(self):
+        response = self.client.post('/bulk/', data=(
+            '{"message": "one"}\n'
+            '{"message": "two"}\n'
+            'not json\n'
+        ))
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.data)
+        self.assertEqual(result['lines'], 3)
+        self.assertEqual(result['created'], 2)
+        self.assertEqual(result['failed'], 1)
+        self.assertEqual(len(self.manager.messages), 2)
+
+    def test_requires_content_length(self):
+        # As the built-in server passes on a chunked request.
+        response = self.client.post(
+            '/bulk/',
+            input_stream=BytesIO(b'{"message": "one"}\n'),
+            headers={'Transfer-Encoding': 'chunked'},
+            environ_overrides={'CONTENT_LENGTH': ''},
+        )
+        self.assertEqual(response.status_code, 411)
+        self.assertEqual(self.manager.messages, [])
+
+
+class NoopTest(WebTestCase):
+    def put(self, url, data):
+        return self.client.put(url, data=json.dumps(data))
+
+    def assertNoop(self, response, noop=True):
+        self.assertEqual(response.headers.get(NOOP_HEADER), (
+            'true' if noop else None
+        ))
+
+    def test_identical_put(self):
+        response = self.put(
+            '/message/a/', {'message': 'one', 'color': [255, 0, 0]}
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertNoop(response, False)
+        stored = self.manager.messages_by_id['a']
+
+        # Field order and formatting do not make a write different.
+        response = self.client.put('/message/a/', data=(
+            '{"color":[255,0,0],"message":"one"}'
+        ))
+        self.assertEqual(response.status_code, 200)
+        self.assertNoop(response)
+        self.assertIs(self.manager.messages_by_id['a'], stored)
+
+    def test_changed_put(self):
+        self.put('/message/a/', {'message': 'one'})
+        response = self.put('/message/a/', {'message': 'two'})
+        self.assertEqual(response.status_code, 201)
+        self.assertNoop(response, False)
+        self.assertEqual(self.manager.messages_by_id['a'].message, 'two')
+
+    def test_patch(self):
+        self.put('/message/a/', {'message': 'one', 'priority': 5})
+        response = self.client.patch(
+            '/message/a/', data=json.dumps({'priority': 5})
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNoop(response)
+
+        response = self.client.patch(
+            '/message/a/', data=json.dumps({'priority': 6})
+        )
+        self.assertNoop(response, False)
+        self.assertEqual(self.manager.messages_by_id['a'].priority, 6)
+
+    def test_flash(self):
+        response = self.put('/flash/', {'message': 'one'})
+        self.assertEqual(response.status_code, 201)
+        self.assertNoop(response, False)
+        response = self.put('/flash/', {'message': 'one'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNoop(response)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+from functools import wraps
+import json
+import multiprocessing
+import os
+import time
+import uuid
+
+
+# Requests are given a trace id when they arrive over HTTP.  The id
+# travels with the frames sent between processes on their behalf and
+# each process appends timed spans for it to a shared file in Chrome's
+# trace event format (open it with chrome://tracing or Perfetto).  The
+# file is a JSON array whose closing bracket, as the format permits, is
+# never written, so that any process can append to it at any time.
+
+TRACE_HEADER = 'X-Trace-Id'
+
+_path = None
+_fd = None
+_fd_pid = None
+_current = None
+
+
+def enable(path):
+    global _path
+    with open(path, 'w') as out:
+        out.write('[\n')
+    _path = path
+
+
+def is_enabled():
+    return _path is not None
+
+
+def new_trace_id():
+    return uuid.uuid4().hex[:16]
+
+
+def get_current():
+    return _current
+
+
+def set_current(trace_id):
+    global _current
+    _current = trace_id
+
+
+def _write(event):
+    global _fd, _fd_pid
+    pid = os.getpid()
+    if _fd_pid != pid:
+        # Every process opens the file for itself; appends of a single
+        # line each do not interleave.
+        _fd = os.open(_path, os.O_WRONLY | os.O_APPEND)
+        _fd_pid = pid
+        _write({
+            'name': 'process_name',
+            'ph': 'M',
+            'pid': pid,
+            'args': {'name': multiprocessing.current_process().name},
+        })
+    event.setdefault('pid', pid)
+    event.setdefault('tid', 0)
+    os.write(_fd, json.dumps(event) + ',\n')
+
+
+def record(name, trace_id, start, end, **args):
+    if _path is None or trace_id is None:
+        return
+    args['trace_id'] = trace_id
+    _write({
+        'name': name,
+        'cat': 'twoline',
+        'ph': 'X',
+        'ts': start * 1e6,
+        'dur': (end - start) * 1e6,
+        'args': args,
+    })
+
+
+def _flow(phase, trace_id, timestamp, **extra):
+    if _path is None:
+        return
+    event = {
+        'name': 'request',
+        'cat': 'twoline',
+        'ph': phase,
+        'id': trace_id,
+        'ts': timestamp * 1e6,
+    }
+    event.update(extra)
+    _write(event)
+
+
+class Span(object):
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.trace_id = _current
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, self.trace_id, self.start, time.time(), **self.args)
+
+
+class NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_null_span = NullSpan()
+
+
+def span(name, **args):
+    if _path is None or _current is None:
+        return _null_span
+    return Span(name, args)
+
+
+def traced(fn):
+    @wraps(fn)
+    def wrapped(*args, **kwargs):
+        with span(fn.__name__):
+            return fn(*args, **kwargs)
+    return wrapped
+
+
+def wrap(frame, trace_id=None):
+    # Frames sent on behalf of a traced request carry its id and the time
+    # they were sent, so that the receiver can account for the wait.
+    if trace_id is None:
+        trace_id = _current
+    if _path is None or trace_id is None:
+        return frame
+    cmd, args = frame
+    now = time.time()
+    _flow('s', trace_id, now)
+    return 'traced', [trace_id, now, cmd, args]
+
+
+def unwrap(frame):
+    cmd, args = frame
+    if cmd != 'traced':
+        return frame
+    trace_id, sent_at, cmd, args = args
+    set_current(trace_id)
+    now = time.time()
+    record('pipe: %s' % cmd, trace_id, sent_at, now)
+    _flow('f', trace_id, now, bp='e')
+    return cmd, list(args)
@@ -1,15 +1,40 @@
 import datetime
 import json
 import logging
+import time
+import zlib
 
-from flask import Flask, make_response, request
+from flask import Flask, g, make_response, request
 
-from twoline.exceptions import InvalidRequest, NotFound, BadRequest
+from twoline import memory, startup, tracing
+from twoline.capture import TeeStream
+from twoline.diagnostics import get_events, merge_events
+from twoline.exceptions import (
+    InvalidRequest, NotFound, BadRequest, QuotaExceeded, LengthRequired
+)
 
 
 logger = logging.getLogger(__name__)
 
 
+NOOP_HEADER = 'X-Twoline-Noop'
+# Names whose quota a write counts against; defaults to the client's
+# address.
+PRODUCER_HEADER = 'X-Twoline-Producer'
+
+# Responses holding a list at least this long are encoded incrementally
+# (and gzipped, if the client accepts it) rather than built in memory.
+STREAM_MIN_ITEMS = 100
+STREAM_CHUNK_SIZE = 8192
+COMPACT_SEPARATORS = (',', ':')
+# Bulk loads are passed to the manager this many lines at a time, and
+# report at most this many of their errors.
+BULK_CHUNK_LINES = 500
+BULK_MAX_LINE_BYTES = 65536
+BULK_MAX_ERRORS = 100
+GZIP_WBITS = 31
+
+
 app = Flask(__name__)
 
 
@@ -27,16 +52,30 @@ def send_data(msg, data=None):
         msg,
         data
     )
-    pipe().send((
+    pipe().send(tracing.wrap((
         msg, data
-    ))
+    )))
+
+
+def get_request_stream():
+    # Views reading the body as it arrives use this rather than
+    # ``request.stream`` so that a capture still records the body.
+    if app.config.get('CAPTURE') is None:
+        return request.stream
+    g.capture_stream = TeeStream(request.stream)
+    return g.capture_stream
+
+
+def get_producer():
+    return request.headers.get(PRODUCER_HEADER) or request.remote_addr or ''
 
 
 def send_and_receive(msg, data=None):
-    send_data(msg, data)
-    while not pipe().poll():
-        pass
-    t, args = pipe().recv()
+    with tracing.span('wait for manager', command=msg):
+        send_data(msg, data)
+        while not pipe().poll():
+            pass
+        t, args = pipe().recv()
     if t == 'error':
         logger.error('Received error response %s', args)
         raise args[0]
@@ -44,21 +83,132 @@ def send_and_receive(msg, data=None):
     return args
 
 
+def handle_data(obj):
+    if isinstance(obj, datetime.datetime):
+        return obj.isoformat()
+    raise TypeError
+
+
+def get_encoder():
+    # ``?compact=1`` asks for the response without indentation.
+    if request.args.get('compact', '').lower() in ('1', 'true', 'yes'):
+        return json.JSONEncoder(
+            default=handle_data, separators=COMPACT_SEPARATORS
+        )
+    return json.JSONEncoder(default=handle_data, indent=2)
+
+
+def is_large(data):
+    return any(
+        isinstance(value, list) and len(value) >= STREAM_MIN_ITEMS
+        for value in data.values()
+    )
+
+
+def iter_chunks(chunks):
+    # ``iterencode`` yields individual tokens; gather them into chunks of
+    # a useful size before they are written out.
+    buffered, size = [], 0
+    for chunk in chunks:
+        buffered.append(chunk)
+        size += len(chunk)
+        if size >= STREAM_CHUNK_SIZE:
+            yield ''.join(buffered)
+            buffered, size = [], 0
+    if buffered:
+        yield ''.join(buffered)
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, GZIP_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
 def json_response(status_code=200, **kwargs):
-    def handle_data(obj):
-        if isinstance(obj, datetime.datetime):
-            return obj.isoformat()
-        raise TypeError
-    response = make_response(
-        json.dumps(
-            kwargs,
-            default=handle_data,
-            indent=2
-        ),
-        status_code
+    encoder = get_encoder()
+    # A capture needs the whole response to compare it on replay, so
+    # nothing is streamed while one is active.
+    if not is_large(kwargs) or app.config.get('CAPTURE') is not None:
+        response = make_response(encoder.encode(kwargs), status_code)
+        response.status_code = status_code
+        response.headers['Content-Type'] = 'application/json'
+        return response
+
+    chunks = iter_chunks(encoder.iterencode(kwargs))
+    compress = 'gzip' in request.accept_encodings
+    if compress:
+        chunks = gzip_chunks(chunks)
+    response = app.response_class(
+        chunks, status=status_code, mimetype='application/json'
     )
-    response.status_code = status_code
-    response.headers['Content-Type'] = 'application/json'
+    response.headers['Vary'] = 'Accept-Encoding'
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def write_response(response, status_code=200):
+    # Write commands answer with the record and whether the write was a
+    # no-op, i.e. identical to what was already stored.
+    record, noop = response
+    if noop:
+        status_code = 200
+    response = json_response(status_code=status_code, **record)
+    if noop:
+        response.headers[NOOP_HEADER] = 'true'
+    return response
+
+
+@app.before_request
+def mark_first_request():
+    startup.mark('web', 'first HTTP request')
+
+
+@app.before_request
+def start_trace():
+    if tracing.is_enabled():
+        g.trace_started = time.time()
+        tracing.set_current(
+            request.headers.get(tracing.TRACE_HEADER)
+            or tracing.new_trace_id()
+        )
+
+
+@app.after_request
+def finish_trace(response):
+    trace_id = tracing.get_current()
+    if trace_id is not None:
+        tracing.record(
+            '%s %s' % (request.method, request.path),
+            trace_id,
+            g.trace_started,
+            time.time(),
+            status=response.status_code,
+        )
+        response.headers[tracing.TRACE_HEADER] = trace_id
+        tracing.set_current(None)
+    return response
+
+
+@app.before_request
+def start_capture():
+    if app.config.get('CAPTURE') is not None:
+        g.capture_started = time.time()
+
+
+@app.after_request
+def capture_request(response):
+    capture = app.config.get('CAPTURE')
+    if capture is not None:
+        stream = getattr(g, 'capture_stream', None)
+        capture.record(
+            request, response, g.capture_started, time.time(),
+            stream.getvalue() if stream is not None else None
+        )
     return response
 
 
@@ -71,6 +221,10 @@ def exception_handler(e):
         status_code = 404
     elif isinstance(e, BadRequest):
         status_code = 400
+    elif isinstance(e, QuotaExceeded):
+        status_code = 429
+    elif isinstance(e, LengthRequired):
+        status_code = 411
     return json_response(
         status_code=status_code,
         error=str(e)
@@ -101,6 +255,104 @@ def index():
     )
 
 
+@app.route('/events/', methods=['GET'])
+def events():
+    limit = request.args.get('limit', type=int)
+    response = send_and_receive(
+        'get_events', limit
+    )
+    events = merge_events(get_events(limit), response)
+    if limit is not None:
+        events = events[-limit:]
+    return json_response(
+        events=events
+    )
+
+
+@app.route('/memory/', methods=['GET'])
+def memory_usage():
+    response = send_and_receive('get_memory')
+    report = response[0]
+    report['web'] = {
+        'process': memory.get_memory_usage(),
+        'manager_pipe_bytes': memory.get_pipe_usage(pipe()),
+    }
+    return json_response(**report)
+
+
+@app.route('/memory/tracemalloc/', methods=['GET', 'POST', 'DELETE'])
+def memory_tracemalloc():
+    if request.method == 'POST':
+        send_and_receive('start_tracemalloc')
+    elif request.method == 'DELETE':
+        send_and_receive('stop_tracemalloc')
+    response = send_and_receive('get_tracemalloc', [
+        request.args.get('limit', 10, type=int),
+        request.args.get('diff', '').lower() in ('1', 'true', 'yes'),
+    ])
+    return json_response(**response[0])
+
+
+def iter_lines(stream, max_length, chunk_size=STREAM_CHUNK_SIZE):
+    # Yields the lines of ``stream`` as they arrive; lines longer than
+    # ``max_length`` are discarded as they are read and yielded as
+    # ``None``.
+    buffered = b''
+    overlong = False
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        lines = (buffered + chunk).split(b'\n')
+        buffered = lines.pop()
+        for line in lines:
+            yield None if overlong or len(line) > max_length else line
+            overlong = False
+        if len(buffered) > max_length:
+            buffered = b''
+            overlong = True
+    if buffered or overlong:
+        yield None if overlong else buffered
+
+
+@app.route('/bulk/', methods=['POST'])
+def bulk():
+    # Without a length the body cannot be read here at all (it is either
+    # chunked or absent), and would load as zero lines.
+    if request.content_length is None:
+        raise LengthRequired('Bulk loads must be sent with a Content-Length')
+    producer = get_producer()
+    totals = {'created': 0, 'updated': 0, 'unchanged': 0, 'failed': 0}
+    errors = []
+
+    def load(first_line, lines):
+        result = send_and_receive(
+            'load_messages', [first_line, lines, producer]
+        )[0]
+        for key in totals:
+            totals[key] += result[key]
+        errors.extend(result['errors'][:BULK_MAX_ERRORS - len(errors)])
+
+    lines = []
+    first_line = number = 0
+    for number, line in enumerate(
+        iter_lines(get_request_stream(), BULK_MAX_LINE_BYTES), 1
+    ):
+        if not lines:
+            first_line = number
+        lines.append(line)
+        if len(lines) >= BULK_CHUNK_LINES:
+            load(first_line, lines)
+            lines = []
+    if lines:
+        load(first_line, lines)
+    return json_response(
+        lines=number,
+        errors=errors,
+        **totals
+    )
+
+
 @app.route('/contrast/', methods=['PUT'])
 def contrast():
     response = send_and_receive(
@@ -125,7 +377,7 @@ def brightness():
 def message_list():
     if request.method == 'POST':
         response = send_and_receive(
-            'post_message', request.data
+            'post_message', [request.data, get_producer(), ]
         )
         return json_response(
             status_code=201,
@@ -144,12 +396,9 @@ def message_list():
 def flash():
     if request.method == 'PUT':
         response = send_and_receive(
-            'put_flash', request.data
-        )
-        return json_response(
-            status_code=201,
-            **response[0]
+            'put_flash', [request.data, get_producer(), ]
         )
+        return write_response(response, status_code=201)
     elif request.method == 'DELETE':
         response = send_and_receive(
             'delete_flash'
@@ -166,6 +415,41 @@ def flash():
         )
 
 
+@app.route('/tag/', methods=['GET'])
+def tag_list():
+    response = send_and_receive(
+        'get_tags'
+    )
+    return json_response(
+        tags=response[0]
+    )
+
+
+@app.route('/tag/<tag>/', methods=['GET', 'DELETE', 'PATCH'])
+def tag(tag):
+    if request.method == 'GET':
+        response = send_and_receive(
+            'get_messages_by_tag', tag
+        )
+        return json_response(
+            messages=response
+        )
+    elif request.method == 'DELETE':
+        response = send_and_receive(
+            'delete_messages_by_tag', tag
+        )
+        return json_response(
+            deleted=response[0]
+        )
+    elif request.method == 'PATCH':
+        response = send_and_receive(
+            'patch_messages_by_tag', [tag, request.data, get_producer(), ]
+        )
+        return json_response(
+            messages=response
+        )
+
+
 @app.route('/message/<message_id>/', methods=['GET', 'PUT', 'DELETE', 'PATCH'])
 def message(message_id):
     if request.method == 'GET':
@@ -184,16 +468,13 @@ def message(message_id):
         )
     elif request.method == 'PUT':
         response = send_and_receive(
-            'put_message_by_id', [message_id, request.data, ]
-        )
-        return json_response(
-            status_code=201,
-            **response[0]
+            'put_message_by_id', [message_id, request.data, get_producer()]
         )
+        return write_response(response, status_code=201)
     elif request.method == 'PATCH':
         response = send_and_receive(
-            'patch_message_by_id', [message_id, request.data, ]
-        )
-        return json_response(
-            **response[0]
+            'patch_message_by_id', [
+                message_id, request.data, get_producer(),
+            ]
         )
+        return write_response(response)